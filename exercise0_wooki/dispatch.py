@@ -15,18 +15,48 @@ exercise_files = {0: ["generator.py", "main.py", "pattern.py"],
                   4: ["data.py", "train.py", "trainer.py", "model.py"]}
 
 
-def coherency_check(actual_files, desired_files, print_out = True):
+unit_test_files = ["NumpyTests.py", "NeuralNetworkTests.py", "PytorchChallengeTests.py"]
+
+
+def build_index(files):
+    # maps the lower-cased basename to all walked paths carrying that name (in walk order), so every lookup
+    # afterwards is a single dict access instead of a scan over all files
+    index = {}
+    for file in files:
+        index.setdefault(os.path.split(file)[1].lower(), []).append(file)
+    return index
+
+
+def lookup(index, file_name):
+    # exact, case-insensitive match on the basename. Returns all candidates, more than one means ambiguity
+    return index.get(os.path.split(file_name)[1].lower(), [])
+
+
+def resolve_manifest(index, desired_files):
+    # manifest mode: resolves a whole per-exercise list of exercise_files at once
+    resolved = {}
     missing_files = []
     ambigous_files = []
     for des_file in desired_files:
-        found = 0
-        for act_file in actual_files:
-            if des_file.lower() == os.path.split(act_file)[1].lower():
-                found += 1
-        if found == 0:
+        candidates = lookup(index, des_file)
+        if len(candidates) == 0:
             missing_files.append(des_file)
-        elif found > 1:
+            continue
+        if len(candidates) > 1:
             ambigous_files.append(des_file)
+        resolved[des_file] = candidates[0]
+    return resolved, missing_files, ambigous_files
+
+
+def _as_index(actual_files):
+    # the functions below accept either the plain file list from get_files or an index built from it
+    if isinstance(actual_files, dict):
+        return actual_files
+    return build_index(actual_files)
+
+
+def coherency_check(actual_files, desired_files, print_out = True):
+    _, missing_files, ambigous_files = resolve_manifest(_as_index(actual_files), desired_files)
     if len(missing_files) and print_out :
         print("The following files could not be found: ")
         for i, f in enumerate(missing_files):
@@ -42,13 +72,9 @@ def coherency_check(actual_files, desired_files, print_out = True):
 
 
 def dispatch(actual_files, desired_files, output_file):
-    files_to_dispatch = []
-    for des_file in desired_files:
-        for act_file in actual_files:
-            if des_file.lower() in act_file.lower():
-                files_to_dispatch.append(act_file)
-                break
-    # assert len(files_to_dispatch) == len(desired_files)
+    # ambiguous names fall back to the first walked file, missing ones are left out
+    resolved, _, _ = resolve_manifest(_as_index(actual_files), desired_files)
+    files_to_dispatch = list(resolved.values())
 
     if not output_file.endswith(".zip"):
         output_file += ".zip"
@@ -68,14 +94,17 @@ def get_files(path):
 
 
 def get_exercise_number(files):
-    unit_test_files = list(filter(lambda x: "numpytests" in x.lower() or "neuralnetworktests" in x.lower() or "pytorchchallengetests" in x.lower(), files))
+    index = _as_index(files)
+    unit_tests = []
+    for test_file in unit_test_files:
+        unit_tests.extend(lookup(index, test_file))
     ids = []
-    for file in unit_test_files:
+    for file in unit_tests:
         with open(file, "r") as f:
             lines = f.readlines()
             for l in lines:
-                if "ID" in l:
-                    ids.append(int(re.search("\d", l).group(0)))
+                if re.match(r"\s*ID\s*=", l):
+                    ids.append(int(re.search(r"\d+", l).group(0)))
     if len(ids) == 1:
         return ids[0]
     elif len(ids) > 1:
@@ -122,13 +151,14 @@ if __name__ == "__main__":
 
     files = get_files(args.input)
     files = list(filter(lambda x: not x.endswith(".pyc"), files))
-    ex_nr = get_exercise_number(files)
+    index = build_index(files)
+    ex_nr = get_exercise_number(index)
     print("Exercise {} is about to be dispatched".format(ex_nr))
-    if not coherency_check(files, exercise_files[ex_nr]):
+    if not coherency_check(index, exercise_files[ex_nr]):
         print("It seems the files listed above are missing. Please check your files if you still want to submit them")
         response = input("Do you want to continue with the dispatch? [y/n]: ")
         if response.lower() == "y":
-            dispatch(files, exercise_files[ex_nr], args.output)
+            dispatch(index, exercise_files[ex_nr], args.output)
             print("Your submission is ready to be submitted. Notice, the files listed above we're not dispatched.")
             print("Please upload {} now to studon".format(args.output))
         elif response.lower() == "n":
@@ -136,7 +166,7 @@ if __name__ == "__main__":
         else:
             print("Decision unclear:{}. Dispatching has been stopped".format(response))
     else:
-        dispatch(files, exercise_files[ex_nr], args.output)
+        dispatch(index, exercise_files[ex_nr], args.output)
         print("Your submission contains all it needs and is ready to be submitted")
         print("Please upload {} now to studon".format(args.output))
 
@@ -0,0 +1,49 @@
+import time
+from argparse import ArgumentParser
+import numpy as np
+import pattern
+
+
+# Compares the draw() backends of the patterns, e.g.:  python bench_patterns.py --resolutions 4096 8192 16384
+# Note that the 'numpy' backend of Circle needs several int64 meshgrid temporaries, i.e. about
+# 3 * 8 * resolution**2 bytes (24 GB at 32k), while the 'blocked' backend only needs the output itself.
+# 32k is therefore not run by default, add it explicitly (--resolutions ... 32768) on a machine with enough memory.
+
+
+def measure(make, backend, repeats):
+    # best wall time of `repeats` draws
+    best = np.inf
+    for _ in range(repeats):
+        p = make()
+        start = time.perf_counter()
+        p.draw(backend=backend)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark(resolutions=(4096, 8192, 16384), backends=('numpy', 'blocked'), repeats=3):
+    """
+    Times the draw() backends of Circle and Spectrum for the given resolutions.
+
+    Returns:
+        list: rows of [pattern, resolution, seconds per backend ...]
+    """
+    table = []
+    for resolution in resolutions:
+        for name, make in [("Circle", lambda: pattern.Circle(resolution, resolution // 4, (resolution // 2, resolution // 3))),
+                           ("Spectrum", lambda: pattern.Spectrum(resolution))]:
+            table.append([name, resolution] + [measure(make, backend, repeats) for backend in backends])
+    return table
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmarks the draw() backends of Circle and Spectrum")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[4096, 8192, 16384])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    import tabulate
+    backends = ('numpy', 'blocked')
+    print(tabulate.tabulate(benchmark(args.resolutions, backends, args.repeats),
+                            headers=['Pattern', 'Resolution'] + ['{} (s)'.format(b) for b in backends],
+                            tablefmt="github", floatfmt=".3f"))
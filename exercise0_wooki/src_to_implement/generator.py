@@ -5,14 +5,992 @@ import numpy as np
 import matplotlib.pyplot as plt
 from skimage.transform import resize
 from skimage import io
+import re
+import sys
+import contextlib
+import copy
+import socket
 import random
+import queue
+import threading
+import functools
+import hashlib
+import time
+import weakref
+from collections import deque
+from io import StringIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import shared_memory, resource_tracker
+
+
+def bilinear_gather(images, ys, xs, out=None):
+    """
+    Samples a batch of images at (fractional) pixel coordinates with bilinear interpolation.
+
+    Parameters:
+        images: array of shape (B, h, w, C) with the source images
+        ys, xs: row and column coordinates, broadcastable to (B, H, W), e.g. (B, H, 1) and (B, 1, W) for
+                axis aligned windows. Coordinates outside of the image are clamped to the border.
+        out: optional float buffer of shape (B, H, W, C) the result is written to
+
+    Returns:
+        np.ndarray: the sampled batch of shape (B, H, W, C)
+    """
+    b, h, w = images.shape[:3]
+    ys = np.clip(ys, 0, h - 1)
+    xs = np.clip(xs, 0, w - 1)
+    y0 = np.floor(ys).astype(np.intp)
+    x0 = np.floor(xs).astype(np.intp)
+    y1 = np.minimum(y0 + 1, h - 1)
+    x1 = np.minimum(x0 + 1, w - 1)
+    wy = (ys - y0)[..., None]
+    wx = (xs - x0)[..., None]
+    bi = np.arange(b).reshape(-1, 1, 1)
+
+    # one gather per neighbour for the whole batch, blended in place
+    top = images[bi, y0, x0] * (1 - wx)
+    top += images[bi, y0, x1] * wx
+    bottom = images[bi, y1, x0] * (1 - wx)
+    bottom += images[bi, y1, x1] * wx
+    top *= 1 - wy
+    bottom *= wy
+    if out is None:
+        return np.add(top, bottom)
+    return np.add(top, bottom, out=out)
+
+
+@functools.lru_cache(maxsize=None)
+def affine_base_grid(height, width):
+    # output pixel coordinates (x, y) relative to the image center, shape (2, height * width).
+    # Cached per image size, only the transform parameters change from batch to batch
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float64)
+    grid = np.stack([xx.ravel() - (width - 1) / 2, yy.ravel() - (height - 1) / 2])
+    grid.flags.writeable = False
+    return grid
+
+
+def read_npy(path):
+    # memory mapped, only the pages that are actually used get read
+    return np.load(path, mmap_mode='r')
+
+
+def read_image(path):
+    return io.imread(path)
+
+
+def read_raw(path, shape=None, dtype=np.uint8):
+    # headerless pixel data. Without a shape the image is assumed to be square with 3 (or 1) channels
+    data = np.fromfile(path, dtype=dtype)
+    if shape is None:
+        channels = 3 if data.size % 3 == 0 and int(np.sqrt(data.size // 3)) ** 2 == data.size // 3 else 1
+        side = int(np.sqrt(data.size // channels))
+        shape = (side, side, channels)
+    return data.reshape(shape)
+
+
+# file extension -> function reading a file into an array, extend with register_reader
+readers = {'.npy': read_npy, '.png': read_image, '.jpg': read_image, '.jpeg': read_image, '.raw': read_raw}
+
+
+def register_reader(extension, reader):
+    # e.g. register_reader('.raw', functools.partial(read_raw, shape=(64, 64, 3)))
+    readers[extension.lower()] = reader
+
+
+def read_file(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in readers:
+        raise ValueError("No reader registered for files of type '{}' ({})".format(extension, path))
+    return readers[extension](path)
+
+
+def cache_path(cache_dir, img_path, image_size):
+    # cache entries are keyed by (file, modification time, image size), a changed file gets a new entry
+    key = "{}|{}|{}".format(os.path.abspath(img_path), os.stat(img_path).st_mtime_ns, image_size)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+
+def load_sample(img_path, image_size=None, cache_dir=None):
+    # reads an image and resizes it to image_size (if given), going through the disk cache in cache_dir (if given)
+    if cache_dir is not None:
+        cached = cache_path(cache_dir, img_path, image_size)
+        if os.path.exists(cached):
+            return np.load(cached)
+
+    image = read_file(img_path)
+
+    # skimage.transform.resize (=! reshape)
+    if image_size is not None:
+        image = resize(image=image, output_shape=image_size) #, mode='reflect', anti_aliasing=True)
+
+    if cache_dir is not None:
+        # write to a temporary file first, so a concurrent reader never sees a half written entry
+        tmp = cached + '.{}.tmp'.format(os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, image)
+        os.replace(tmp, cached)
+    return image
+
+
+# Declarative loading pipeline: read -> decode -> resize -> augment -> normalize -> batch.
+# Every stage draws its random parameters with draw() and applies them with apply(), so a run of stages can be
+# replaced by one fused stage which draws the same parameters in the same order (and thus gives the same result).
+class Stage:
+    pointwise = False  # elementwise in float64, apply(x, params, out) may write in place
+    geometric = False  # pixel permutation, apply() returns a view and dihedral() describes it
+    fresh = False  # apply() returns a new, writable float64 array which the following stages may overwrite
+
+    def draw(self):
+        return None
+
+    def apply(self, x, params):
+        raise NotImplementedError
+
+    def __call__(self, x):
+        return self.apply(x, self.draw())
+
+    def __repr__(self):
+        return type(self).__name__
+
+
+class Read(Stage):
+    # file name -> path in file_path
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def apply(self, name, params):
+        return os.path.join(self.file_path, name)
+
+
+class Decode(Stage):
+    # path -> array, with the reader registered for the file type
+    def apply(self, path, params):
+        return read_file(path)
+
+
+class Resize(Stage):
+    fresh = True
+
+    def __init__(self, image_size):
+        self.image_size = tuple(image_size)
+
+    def apply(self, x, params):
+        return resize(image=x, output_shape=self.image_size)
+
+
+def orient(x, flip, k):
+    # view of x mirrored left/right (if flip) and then rotated by k * 90 degrees, x itself for the identity
+    if not flip and k % 4 == 0:
+        return x
+    return np.rot90(np.fliplr(x) if flip else x, k)
+
+
+class Mirror(Stage):
+    geometric = True
+
+    def __init__(self, p=0.5):
+        self.p = p
+
+    def draw(self):
+        return random.random() < self.p
+
+    def dihedral(self, params):
+        return int(params), 0
+
+    def apply(self, x, params):
+        return np.fliplr(x) if params else x
+
+
+class Rotate90(Stage):
+    geometric = True
+
+    def __init__(self, angles=(90, 180, 270)):
+        self.angles = angles
+
+    def draw(self):
+        return random.choice(self.angles)
+
+    def dihedral(self, params):
+        return 0, params // 90
+
+    def apply(self, x, params):
+        return np.rot90(x, k=params // 90)
+
+
+class Normalize(Stage):
+    # (x - mean) / std with scalar or per-channel mean and std
+    pointwise = True
+
+    def __init__(self, mean=0.0, std=1.0):
+        if np.ndim(mean) > 1 or np.ndim(std) > 1:
+            raise ValueError("mean and std must be scalars or per-channel")
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.std = np.asarray(std, dtype=np.float64)
+
+    def apply(self, x, params, out=None):
+        out = np.subtract(x, self.mean, out=out, dtype=np.float64)
+        return np.divide(out, self.std, out=out)
+
+
+class Scale(Stage):
+    # x * factor, e.g. Scale(1 / 255) for uint8 images which are not resized
+    pointwise = True
+
+    def __init__(self, factor):
+        self.factor = np.float64(factor)
+
+    def apply(self, x, params, out=None):
+        return np.multiply(x, self.factor, out=out, dtype=np.float64)
+
+
+class Batch(Stage):
+    # stacks the samples into one (B, H, W, C) array, always the last stage
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
+
+    def apply(self, samples, params):
+        return np.stack(samples).astype(self.dtype, copy=False)
+
+
+class FusedStage(Stage):
+    """
+    Runs a sequence of geometric and pointwise stages (optionally headed by a stage returning a fresh array, e.g.
+    Resize) as a single pass over the buffer.
+
+    The geometric stages are composed into one mirror/rotation view and the pointwise stages are applied in place,
+    either on the fresh output of the head or directly into the output buffer (e.g. the slot of the batch). Since
+    the pointwise stages are per pixel (and per channel), they commute with the geometric ones.
+    """
+
+    def __init__(self, stages, head=None):
+        self.stages = list(stages)
+        self.head = head
+
+    def draw(self):
+        return (None if self.head is None else self.head.draw()), [stage.draw() for stage in self.stages]
+
+    def apply(self, x, params, out=None):
+        head_params, stage_params = params
+        fresh = False
+        if self.head is not None:
+            x, fresh = self.head.apply(x, head_params), True
+
+        # compose the mirror/rotation of all geometric stages: first (f1, k1), then (f2, k2)
+        flip, k = 0, 0
+        for stage, p in zip(self.stages, stage_params):
+            if stage.geometric:
+                f2, k2 = stage.dihedral(p)
+                flip, k = (1 - flip, k2 - k) if f2 else (flip, k + k2)
+        y = orient(x, flip, k % 4)
+
+        pointwise = [(stage, p) for stage, p in zip(self.stages, stage_params) if stage.pointwise]
+        if not pointwise:
+            if out is None:
+                return y
+            np.copyto(out, y)
+            return out
+
+        if out is not None and out.dtype == np.float64:
+            target = out
+        elif out is None and fresh and x.dtype == np.float64 and x.flags.writeable:
+            target = y  # y is x or a view of it, the fresh output of the head is overwritten in place
+        else:
+            target = None
+        for stage, p in pointwise:
+            y = target = stage.apply(y, p, out=target)
+        if out is not None and y is not out:
+            np.copyto(out, y)
+            return out
+        return y
+
+    def __call__(self, x, out=None):
+        return self.apply(x, self.draw(), out=out)
+
+    def __repr__(self):
+        stages = ([self.head] if self.head is not None else []) + self.stages
+        return "Fused({})".format(" + ".join(repr(stage) for stage in stages))
+
+
+def fuse_stages(stages):
+    # replaces every run of adjacent geometric/pointwise stages (together with a preceding fresh stage) by a FusedStage
+    plan = []
+    run = None
+    for stage in stages:
+        if stage.geometric or stage.pointwise:
+            if run is None:
+                head = plan.pop() if plan and plan[-1].fresh else None
+                run = FusedStage([], head)
+                plan.append(run)
+            run.stages.append(stage)
+        else:
+            run = None
+            plan.append(stage)
+    return plan
+
+
+class Pipeline:
+    """
+    Loads a batch from a list of file names by running the samples through a sequence of stages,
+    e.g. Pipeline([Read(path), Decode(), Resize((32, 32, 3)), Mirror(), Rotate90(), Normalize(mean, std), Batch()]).
+
+    The stages can be reordered freely and extended by subclassing Stage. With fuse=True adjacent per-pixel stages
+    are fused (see FusedStage) and the last sample stage writes straight into the preallocated batch. The result is
+    the same as with fuse=False for the same random state.
+    """
+
+    def __init__(self, stages, fuse=True):
+        self.stages = list(stages)
+        if any(isinstance(stage, Batch) for stage in self.stages[:-1]):
+            raise ValueError("Batch has to be the last stage of a pipeline")
+        self.batch = self.stages[-1] if self.stages and isinstance(self.stages[-1], Batch) else None
+        sample_stages = self.stages[:-1] if self.batch is not None else self.stages
+        self.fuse = fuse
+        self.plan = fuse_stages(sample_stages) if fuse else sample_stages
+
+    def unfused(self):
+        return Pipeline(self.stages, fuse=False)
+
+    def run_sample(self, item, out=None):
+        for stage in self.plan[:-1]:
+            item = stage(item)
+        if out is not None and isinstance(self.plan[-1], FusedStage):
+            return self.plan[-1](item, out=out)
+        item = self.plan[-1](item)
+        if out is not None:
+            out[...] = item
+        return item
+
+    def __call__(self, items):
+        # returns the batch array, or the list of samples if the pipeline has no Batch stage
+        if self.batch is None or not self.fuse:
+            samples = [self.run_sample(item) for item in items]
+            return samples if self.batch is None else self.batch(samples)
+
+        batch = None
+        for i, item in enumerate(items):
+            if batch is None:
+                first = self.run_sample(item)
+                batch = np.empty((len(items),) + first.shape, dtype=self.batch.dtype)
+                batch[0] = first
+            else:
+                self.run_sample(item, out=batch[i])
+        return batch
+
+    def __repr__(self):
+        return "Pipeline({})".format(" -> ".join(repr(stage) for stage in self.plan + [self.batch] if stage is not None))
+
+
+class SharedBatchRing:
+    """
+    Ring of batch slots in shared memory, used to move batches from loading worker processes to the consumer.
+
+    The workers write a batch in place into a slot (see fill_slot), the consumer gets a NumPy view of the slot,
+    so no batch is ever pickled. A slot is handed out with acquire() and recycled with release().
+    The shared memory is unlinked by close(), when the ring is garbage collected or at interpreter exit, and by
+    the resource tracker if the owning process crashes.
+    """
+
+    def __init__(self, slots: int, batch_shape: tuple, dtype=np.float64):
+        self.shape = (slots,) + tuple(batch_shape)
+        self.dtype = np.dtype(dtype)
+        size = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        self.free = deque(range(slots))
+        self._finalizer = weakref.finalize(self, SharedBatchRing._cleanup, self.shm)
+
+    @staticmethod
+    def _cleanup(shm):
+        try:
+            shm.close()
+        except BufferError:
+            pass  # views of a slot are still alive, the memory is unmapped when they are gone
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def spec(self):
+        # everything a worker needs to attach to the ring
+        return self.shm.name, self.shape, self.dtype.str
+
+    def acquire(self):
+        if not self.free:
+            raise RuntimeError("All slots of the ring are in use, release a slot first")
+        return self.free.popleft()
+
+    def release(self, slot):
+        self.free.append(slot)
+
+    def view(self, slot):
+        return self.array[slot]
+
+    def close(self):
+        self.array = None
+        self._finalizer()
+
+
+# shared memory blocks a worker process is attached to, by name
+_attached = {}
+
+
+def attach_ring(spec):
+    # attaches (once per process) to a SharedBatchRing and returns its slot array
+    name, shape, dtype = spec
+    if name not in _attached:
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    return _attached[name][1]
+
+
+def fill_slot(spec, slot, paths, image_size, cache_dir=None, positions=None):
+    # worker side: loads the samples of one batch (or some of them, at the given positions) straight into a slot
+    batch = attach_ring(spec)[slot]
+    positions = range(len(paths)) if positions is None else positions
+    for position, path in zip(positions, paths):
+        batch[position] = load_sample(path, image_size, cache_dir)
+
+
+def worker_memory(_=None):
+    # peak resident memory of the calling process in bytes (ru_maxrss is in KiB on Linux, in bytes on macOS)
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def start_pool(workers):
+    # the resource tracker has to run before the workers start, so that they share it with this process.
+    # Otherwise every worker starts its own tracker, which unlinks the shared memory when the worker exits
+    resource_tracker.ensure_running()
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def _batch_pickled(batch_shape):
+    return np.full(batch_shape, 0.5)
+
+
+def _batch_shared(spec, slot):
+    attach_ring(spec)[slot].fill(0.5)
+
+
+def compare_transport(batch_shape=(64, 128, 128, 3), batches=50, workers=2):
+    """
+    Compares how fast batches get from worker processes to the consumer, returned as pickled arrays
+    versus written into a SharedBatchRing. The workers only fill the batches, so the transport dominates.
+
+    Returns:
+        dict: batches per second for 'pickle' and 'shared_memory'
+    """
+    result = {}
+    with start_pool(workers) as pool:
+        start = time.perf_counter()
+        for batch in pool.map(_batch_pickled, [batch_shape] * batches):
+            batch.sum(axis=0)
+        result['pickle'] = batches / (time.perf_counter() - start)
+
+        ring = SharedBatchRing(2 * workers, batch_shape)
+        try:
+            start = time.perf_counter()
+            pending = deque()
+            for _ in range(batches):
+                if not ring.free:
+                    future, slot = pending.popleft()
+                    future.result()
+                    ring.view(slot).sum(axis=0)
+                    ring.release(slot)
+                slot = ring.acquire()
+                pending.append((pool.submit(_batch_shared, ring.spec(), slot), slot))
+            for future, slot in pending:
+                future.result()
+                ring.view(slot).sum(axis=0)
+            result['shared_memory'] = batches / (time.perf_counter() - start)
+        finally:
+            ring.close()
+    return result
+
+
+def build_alias_table(weights):
+    """
+    Builds the tables of Vose's alias method for sampling indices proportional to the given weights.
+
+    Building is O(n) once, afterwards every draw is O(1) (see alias_draw).
+
+    Returns:
+        tuple: acceptance probabilities (n,) and alias indices (n,)
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    n = len(weights)
+    prob = weights * n / weights.sum()
+    alias = np.arange(n)
+    small = list(np.flatnonzero(prob < 1))
+    large = list(np.flatnonzero(prob >= 1))
+    while small and large:
+        s, l = small.pop(), large.pop()
+        alias[s] = l
+        prob[l] -= 1 - prob[s]
+        if prob[l] < 1:
+            small.append(l)
+        else:
+            large.append(l)
+    # what is left over is 1 up to rounding errors
+    prob[small + large] = 1
+    return prob, alias
+
+
+def alias_draw(prob, alias, size):
+    # draws size indices from the alias tables, vectorized
+    i = np.random.randint(len(prob), size=size)
+    return np.where(np.random.uniform(size=size) < prob[i], i, alias[i])
+
+
+class SampleCache:
+    """
+    Bounded in-memory cache of samples with CLOCK replacement.
+
+    The samples are stored in one preallocated slab array of (slots, *sample_shape) instead of Python objects,
+    the number of slots follows from the byte budget and the size of the first sample that gets cached.
+    Samples of a different shape are not cached.
+    """
+
+    def __init__(self, num_samples: int, budget_bytes: int):
+        self.num_samples = num_samples
+        self.budget_bytes = budget_bytes
+        self.slab = None
+        self.slot_of = np.full(num_samples, -1, dtype=np.int64)  # sample index -> slot, -1 if not cached
+        self.owner = None  # slot -> sample index, -1 if free
+        self.referenced = None
+        self.hand = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def allocate(self, sample):
+        slots = int(min(self.num_samples, self.budget_bytes // max(1, sample.nbytes)))
+        self.slab = np.empty((slots,) + sample.shape, dtype=sample.dtype)
+        self.owner = np.full(slots, -1, dtype=np.int64)
+        self.referenced = np.zeros(slots, dtype=bool)
+
+    def get(self, index):
+        # returns a view into the slab, or None on a miss
+        slot = self.slot_of[index]
+        if slot < 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.referenced[slot] = True
+        return self.slab[slot]
+
+    def put(self, index, sample):
+        if self.slab is None:
+            self.allocate(sample)
+        if len(self.slab) == 0 or sample.shape != self.slab.shape[1:] or self.slot_of[index] >= 0:
+            return
+        # CLOCK: advance the hand and clear reference bits until an unreferenced slot is found
+        while self.referenced[self.hand]:
+            self.referenced[self.hand] = False
+            self.hand = (self.hand + 1) % len(self.slab)
+        slot = self.hand
+        self.hand = (self.hand + 1) % len(self.slab)
+        if self.owner[slot] >= 0:
+            self.slot_of[self.owner[slot]] = -1
+            self.evictions += 1
+        self.slab[slot] = sample
+        self.owner[slot] = index
+        self.slot_of[index] = slot
+
+    def cached(self, indices):
+        # boolean mask which of the given sample indices are currently cached
+        return self.slot_of[np.asarray(indices, dtype=np.int64)] >= 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'slots': 0 if self.slab is None else len(self.slab)}
+
+
+def chunk_stats(images):
+    # per channel (count, mean, M2, min, max) of a chunk of images (n, H, W, C)
+    pixels = images.reshape(-1, images.shape[-1]) if images.ndim > 3 else images.reshape(-1, 1)
+    mean = pixels.mean(axis=0)
+    m2 = ((pixels - mean) ** 2).sum(axis=0)
+    return len(pixels), mean, m2, pixels.min(axis=0), pixels.max(axis=0)
+
+
+def merge_stats(a, b):
+    # merges two partial (count, mean, M2, min, max) results with the parallel algorithm of Chan et al.
+    n_a, mean_a, m2_a, min_a, max_a = a
+    n_b, mean_b, m2_b, min_b, max_b = b
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / n
+    m2 = m2_a + m2_b + delta ** 2 * n_a * n_b / n
+    return n, mean, m2, np.minimum(min_a, min_b), np.maximum(max_a, max_b)
+
+
+def montage(images, cols=None, padding=0, pad_value=0):
+    """
+    Arranges a stack of images (B, H, W[, C]) into one image (rows * H, cols * W[, C]), e.g. a batch of the
+    ImageGenerator or a stack of Checker/Circle/Spectrum outputs.
+
+    Parameters:
+        images: array of shape (B, H, W[, C]) or a list of equally shaped images
+        cols: number of tiles per row, by default about sqrt(B)
+        padding: pixels of pad_value between the tiles
+        pad_value: value of the padding and of the empty tiles in the last row
+
+    The output buffer is allocated once and viewed as (rows, H + padding, cols, W + padding, C), so every pixel is
+    copied exactly once with a strided assignment. No matplotlib figure is involved, so this is safe to call from
+    any thread and in headless environments.
+
+    Returns:
+        np.ndarray: the montage of shape (rows * (H + padding) - padding, cols * (W + padding) - padding[, C])
+    """
+    b = len(images)
+    h, w = images[0].shape[:2]
+    extra = images[0].shape[2:]
+    cols = cols or int(np.ceil(np.sqrt(b)))
+    rows = -(-b // cols)
+    dtype = images.dtype if isinstance(images, np.ndarray) else np.result_type(*images)
+
+    out = np.full((rows, h + padding, cols, w + padding) + extra, pad_value, dtype=dtype)
+    if isinstance(images, np.ndarray):
+        full = (b // cols) * cols
+        # (rows, cols, H, W, C) -> (rows, H, cols, W, C) happens in the assignment, no intermediate copy
+        out[:b // cols, :h, :, :w] = images[:full].reshape((b // cols, cols, h, w) + extra).swapaxes(1, 2)
+        if full < b:
+            out[-1, :h, :b - full, :w] = images[full:].swapaxes(0, 1)
+    else:
+        for i, image in enumerate(images):
+            out[i // cols, :h, i % cols, :w] = image
+
+    out = out.reshape((rows * (h + padding), cols * (w + padding)) + extra)
+    return out[:out.shape[0] - padding, :out.shape[1] - padding]
+
+
+def to_uint8(image):
+    # float images are expected in [0, 1]
+    image = np.asarray(image)
+    if np.issubdtype(image.dtype, np.floating) or image.dtype == bool:
+        return (np.clip(image, 0, 1) * 255).round().astype(np.uint8)
+    return image.astype(np.uint8)
+
+
+def export_image(image, path):
+    # writes an image (e.g. a mosaic or a pattern output) as .png or, for any other extension, as .npy
+    if path.lower().endswith('.png'):
+        io.imsave(path, to_uint8(image), check_contrast=False)
+    else:
+        np.save(path, image)
+
+
+class BatchExporter:
+    """
+    Exports mosaics of batches (or patterns) to files in a background thread.
+
+    Call it with every batch that was fetched anyway, e.g. exporter(images) after gen.next(). Only every
+    `every`-th call is exported. The exporter never calls next() itself, so the iteration order of the generator
+    stays the same. If the thread falls behind, batches are dropped instead of blocking the caller.
+    A batch which fails to export is recorded in `errors` as (step, exception) and the thread goes on.
+    """
+
+    def __init__(self, directory: str, every=1, cols=None, padding=1, extension='.png', max_queue=4):
+        self.directory = directory
+        self.every = every
+        self.cols = cols
+        self.padding = padding
+        self.extension = extension
+        self.step = 0
+        self.dropped = 0
+        self.errors = []
+        os.makedirs(directory, exist_ok=True)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __call__(self, images):
+        step = self.step
+        self.step += 1
+        if step % self.every:
+            return
+        try:
+            # copied, the caller may reuse the batch buffer (e.g. the shared memory slots of the workers)
+            self.queue.put_nowait((step, np.array(images)))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            step, images = item
+            try:
+                image = images if images.ndim <= 2 or (images.ndim == 3 and images.shape[-1] in (3, 4)) else montage(images, self.cols, self.padding)
+                export_image(image, os.path.join(self.directory, "batch_{:06d}{}".format(step, self.extension)))
+            except Exception as e:
+                self.errors.append((step, e))
+
+    def close(self):
+        # waits until everything queued is written, without blocking if the thread is not running anymore
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.thread.join()
+
+
+def pyramid_levels(batch, sizes):
+    """
+    Derives aligned batches of several smaller image sizes from one batch.
+
+    Every level is computed from the smallest level computed so far which is at least as large. Integer factors
+    (e.g. 128 -> 64 -> 32) are a block mean over the factor x factor pixels, other factors a resize of the whole
+    batch at once.
+
+    Parameters:
+        batch: array of shape (B, H, W, C)
+        sizes: target sizes (h, w, ...) not larger than (H, W)
+
+    Returns:
+        list: the batch itself followed by one batch per size, in the order of sizes
+    """
+    levels = [batch]
+    for size in sizes:
+        h, w = size[:2]
+        source = min((level for level in levels if level.shape[1] >= h and level.shape[2] >= w),
+                     key=lambda level: level.shape[1] * level.shape[2])
+        n, src_h, src_w = source.shape[:3]
+        if src_h % h == 0 and src_w % w == 0:
+            fy, fx = src_h // h, src_w // w
+            level = source.reshape((n, h, fy, w, fx) + source.shape[3:]).mean(axis=(2, 4))
+        else:
+            level = resize(source, (n, h, w) + source.shape[3:])
+        levels.append(level)
+    return levels
+
+
+def host_key():
+    # identifies the machine a tuned loader configuration belongs to
+    return "{}|{}cpus".format(socket.gethostname(), os.cpu_count())
+
+
+def loader_neighbours(config, max_workers, batch_size):
+    # configurations one hill-climbing step away: one worker more/less, one prefetch more/less, chunk size * 2 / 2
+    workers, prefetch, chunk = config['workers'], config['prefetch'], config['chunk_size']
+    candidates = [(workers + 1, prefetch, chunk), (workers - 1, prefetch, chunk),
+                  (workers, prefetch + 1, chunk), (workers, prefetch - 1, chunk)]
+    if workers:
+        candidates += [(workers, prefetch, chunk * 2), (workers, prefetch, chunk // 2)]
+    return [{'workers': w, 'prefetch': p, 'chunk_size': c} for w, p, c in candidates
+            if 0 <= w <= max_workers and 1 <= p <= 8 and 1 <= c <= batch_size]
+
+
+def label_store_path(label_path):
+    # binary label store next to the json file, e.g. data/Labels.npy for data/Labels.json
+    return os.path.splitext(label_path)[0] + '.npy'
+
+
+def iter_json_labels(label_path, chunk_size=1 << 20):
+    """
+    Streams the ("id": label) pairs of a flat json object, e.g. Labels.json, without parsing the whole file.
+
+    The file is read in chunks of chunk_size characters, a pair cut by the chunk boundary is completed with the
+    next chunk. Only integer ids and labels are supported, anything else raises a ValueError.
+    """
+    pair = re.compile(r'"(-?\d+)"\s*:\s*(-?\d+)\s*[,}]')
+    tail = ''
+    with open(label_path, 'r') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            buffer = tail + chunk
+            end = 0
+            for match in pair.finditer(buffer):
+                # only separators may be skipped, anything else is a label the store could not hold
+                if buffer[end:match.start()].strip(' \t\r\n,{'):
+                    raise ValueError("Could not convert {}: unexpected content {!r}".format(
+                        label_path, buffer[end:match.start()][:50]))
+                yield int(match.group(1)), int(match.group(2))
+                end = match.end()
+            tail = buffer[end:]
+            if not chunk:
+                break
+    if tail.strip() not in ('', '}'):
+        raise ValueError("Could not convert {}: unexpected content {!r}".format(label_path, tail[:50]))
+
+
+def convert_labels(label_path, store_path=None, chunk_size=1 << 20):
+    """
+    Converts a json label file into the binary label store: a structured .npy array of int32 ids and
+    uint8 (or int16 if needed) labels, sorted by id, which can be memory mapped.
+
+    Returns:
+        str: path of the label store
+    """
+    from array import array
+    ids, labels = array('i'), array('h')
+    for sample_id, label in iter_json_labels(label_path, chunk_size):
+        ids.append(sample_id)
+        labels.append(label)
+    ids, labels = np.frombuffer(ids, dtype=np.int32), np.frombuffer(labels, dtype=np.int16)
+
+    label_dtype = np.uint8 if len(labels) == 0 or (labels.min() >= 0 and labels.max() < 256) else np.int16
+    order = np.argsort(ids, kind='stable')
+    store = np.empty(len(ids), dtype=[('id', np.int32), ('label', label_dtype)])
+    store['id'], store['label'] = ids[order], labels[order]
+
+    store_path = store_path or label_store_path(label_path)
+    tmp = store_path + '.{}.tmp'.format(os.getpid())
+    with open(tmp, 'wb') as f:
+        np.save(f, store)
+    os.replace(tmp, store_path)
+    return store_path
+
+
+def load_label_store(label_path):
+    # memory mapped label store, None if there is none or it is older than the json labels
+    store_path = label_store_path(label_path)
+    if not os.path.exists(store_path):
+        return None
+    if os.path.exists(label_path) and os.stat(label_path).st_mtime_ns > os.stat(store_path).st_mtime_ns:
+        return None
+    return np.load(store_path, mmap_mode='r')
+
+
+def sample_ids(names):
+    # integer ids of the file names (the stems), -1 for names which are no integers
+    ids = np.full(len(names), -1, dtype=np.int64)
+    for i, name in enumerate(names):
+        stem = os.path.splitext(name)[0]
+        if stem.lstrip('-').isdigit():
+            ids[i] = int(stem)
+    return ids
+
+
+def lookup_labels(store, ids):
+    # labels of the given ids by binary search in the sorted store, -1 for unknown ids
+    ids = np.asarray(ids)
+    pos = np.clip(np.searchsorted(store['id'], ids), 0, max(0, len(store) - 1))
+    if len(store) == 0:
+        return np.full(len(ids), -1, dtype=np.int16)
+    found = store['id'][pos] == ids
+    return np.where(found, store['label'][pos].astype(np.int16), -1)
+
+
+def labels_for_names(label_path, names, labels=None, store=None):
+    # labels of the given file names from the label store if there is one, otherwise from the json labels.
+    # An already loaded store or json labels can be passed in. Raises a KeyError for names without a label
+    if store is None and labels is None:
+        store = load_label_store(label_path)
+    if store is not None:
+        label_array = lookup_labels(store, sample_ids(names))
+    else:
+        if labels is None:
+            with open(label_path, 'r') as f:
+                labels = json.load(f)
+        label_array = np.array([labels.get(name, labels.get(os.path.splitext(name)[0], -1)) for name in names],
+                               dtype=np.int16)
+    missing = [name for name, label in zip(names, label_array) if label < 0]
+    if missing:
+        raise KeyError("No label for {} file(s) in {}, e.g. {}".format(len(missing), label_path, missing[:5]))
+    return label_array
+
+
+class ManifestNames:
+    # read-only sequence of the file names in a memory mapped manifest, decoded only when accessed
+
+    def __init__(self, names):
+        self.names = names
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [name.decode() for name in self.names[index]]
+        return self.names[index].decode()
+
+    def __iter__(self):
+        return (name.decode() for name in self.names)
+
+
+def manifest_paths(file_path):
+    # the manifest lives next to the data directory, e.g. data/exercise_data.manifest.npy (+ .json with its key)
+    base = os.path.normpath(file_path) + '.manifest'
+    return base + '.npy', base + '.json'
+
+
+def manifest_key(file_path, label_path):
+    # adding, removing or renaming files changes the mtime of the directory, relabelling the one of the labels
+    directory = os.stat(file_path)
+    labels = os.stat(label_path)
+    return {'version': 1, 'directory_mtime_ns': directory.st_mtime_ns,
+            'labels': [os.path.abspath(label_path), labels.st_size, labels.st_mtime_ns]}
+
+
+def file_shape(path):
+    # shape of a sample without decoding it, (-1, -1, -1) if it cannot be read from the header
+    if path.lower().endswith('.npy'):
+        with open(path, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape = np.lib.format.read_array_header_1_0(f)[0]
+            else:
+                shape = np.lib.format.read_array_header_2_0(f)[0]
+        return (tuple(shape) + (1, 1, 1))[:3]
+    return (-1, -1, -1)
+
+
+def build_manifest(file_path, label_path, labels=None):
+    """
+    Scans the data directory once with os.scandir and stores one record per file (name, size, modification time,
+    shape and label) as a structured .npy array next to the directory.
+
+    Returns:
+        np.ndarray: the manifest records, sorted by file name
+    """
+    with os.scandir(file_path) as it:
+        entries = sorted((e.name, e.stat()) for e in it if e.is_file())
+    label_array = labels_for_names(label_path, [name for name, _ in entries], labels)
+    width = max([len(name.encode()) for name, _ in entries] + [1])
+    records = np.zeros(len(entries), dtype=[('name', 'S{}'.format(width)), ('size', np.int64), ('mtime', np.int64),
+                                            ('shape', np.int32, (3,)), ('label', np.int16)])
+    for record, (name, st), label in zip(records, entries, label_array):
+        record['name'], record['size'], record['mtime'], record['label'] = name.encode(), st.st_size, st.st_mtime_ns, label
+        record['shape'] = file_shape(os.path.join(file_path, name))
+
+    manifest_file, key_file = manifest_paths(file_path)
+    tmp = manifest_file + '.{}.tmp'.format(os.getpid())
+    with open(tmp, 'wb') as f:
+        np.save(f, records)
+    os.replace(tmp, manifest_file)
+    with open(key_file, 'w') as f:
+        json.dump(manifest_key(file_path, label_path), f)
+    return records
+
+
+def load_manifest(file_path, label_path):
+    # memory maps the manifest of the data directory, rebuilding it first if it is missing or outdated
+    manifest_file, key_file = manifest_paths(file_path)
+    try:
+        with open(key_file, 'r') as f:
+            valid = json.load(f) == manifest_key(file_path, label_path)
+    except (OSError, ValueError):
+        valid = False
+    if not valid or not os.path.exists(manifest_file):
+        build_manifest(file_path, label_path)
+    return np.load(manifest_file, mmap_mode='r')
 
 
 # In this exercise task you will implement an image generator. Generator objects in python are defined as having a next function.
 # This next function returns the next generated object. In our case it returns the input of a neural network each time it gets called.
 # This input consists of a batch of images and its corresponding labels.
 class ImageGenerator:
-    def __init__(self, file_path: str, label_path: str, batch_size: int, image_size: list, rotation=False, mirroring=False, shuffle=False):
+    def __init__(self, file_path: str, label_path: str, batch_size: int, image_size: list, rotation=False, mirroring=False, shuffle=False,
+                 crop=None, crop_size=None, crop_scale=(0.08, 1.0), crop_ratio=(3 / 4, 4 / 3), affine=None,
+                 sampler=None, class_weights=None, sample_weights=None, cache_dir=None, cache_bytes=None, cache_first=False,
+                 workers=0, prefetch=2, chunk_size=None, mixup=0, cutmix=0, manifest=False, pipeline=None,
+                 pyramid=None):
         # Define all members of your generator class object as global members here.
         self.file_path = file_path
         self.label_path = label_path
@@ -22,6 +1000,23 @@ class ImageGenerator:
         self.mirroring = mirroring
         self.shuffle = shuffle
 
+        # crop augmentation: None, 'random', 'center' (window of crop_size pixels, default image_size) or
+        # 'random_resized' (window with crop_scale of the area and crop_ratio aspect ratio).
+        # The window is resampled straight to image_size, the full image is never resized.
+        if crop not in (None, 'random', 'center', 'random_resized'):
+            raise ValueError("crop must be one of None, 'random', 'center' or 'random_resized'")
+        self.crop = crop
+        self.crop_size = crop_size
+        self.crop_scale = crop_scale
+        self.crop_ratio = crop_ratio
+
+        # continuous affine augmentation, e.g. {'rotation': 30, 'scale': (0.9, 1.1), 'shear': 10, 'translate': 0.1}
+        # rotation and shear are maximal angles in degrees, translate is a fraction of the image size.
+        # Independent of the rotation flag, which still only rotates by multiples of 90 degrees
+        if affine is not None and not set(affine) <= {'rotation', 'scale', 'shear', 'translate'}:
+            raise ValueError("affine only supports the keys 'rotation', 'scale', 'shear' and 'translate'")
+        self.affine = affine
+
         # initialize epoch to track how many epoch we are at
         self.epoch = 0
 
@@ -37,14 +1032,35 @@ class ImageGenerator:
                            7: 'horse', 8: 'ship', 9: 'truck'}
         
         # Load file and labels (Assuming the labels are stored in a JSON file)
-        self.image_files = sorted(os.listdir(file_path))
-        with open(self.label_path, 'r') as f:
-            self.labels = json.load(f)
+        # With manifest=True the file list and labels come from a memory mapped manifest next to the data directory,
+        # which is only rebuilt when the directory or the labels change (see load_manifest)
+        self.manifest = None
+        store = None if manifest else load_label_store(label_path)
+        if manifest:
+            self.manifest = load_manifest(file_path, label_path)
+            self.image_files = ManifestNames(self.manifest['name'])
+            self.labels = None  # the labels come from the manifest
+            self.label_array = self.manifest['label']
+            self.num_images = len(self.manifest)
+        elif store is not None:
+            # binary label store (see convert_labels), used instead of the json labels when it is present
+            self.image_files = sorted(os.listdir(file_path))
+            self.labels = None
+            self.label_array = labels_for_names(label_path, self.image_files, store=store)
+            self.num_images = len(self.image_files)
+        else:
+            self.image_files = sorted(os.listdir(file_path))
+            with open(self.label_path, 'r') as f:
+                self.labels = json.load(f)
 
-        # Get all image filenames and their corresponding labels
-        self.image_filenames = list(self.labels.keys())
-        self.num_images = len(self.image_filenames)
+            # Get all image filenames and their corresponding labels
+            self.image_filenames = list(self.labels.keys())
+            self.num_images = len(self.image_filenames)
+            self.label_array = labels_for_names(label_path, self.image_files, self.labels)
         
+        # dataset indices this generator iterates over, a subset for the views created by view() and split()
+        self.subset = np.arange(self.num_images)
+
         # Shuffle indices if needed
         if self.shuffle:
             self.indices = list(range(self.num_images))
@@ -63,18 +1079,123 @@ class ImageGenerator:
         # Initialize iterator
         self.current_index = 0
 
+        # sampling strategy: None (iterate the index list), 'balanced' (equal number of samples per class in every
+        # batch), 'weighted' (with replacement, proportional to sample_weights or class_weights, default inverse
+        # class frequency) or 'stratified' (epochs in which every batch keeps the class proportions)
+        if sampler not in (None, 'balanced', 'weighted', 'stratified'):
+            raise ValueError("sampler must be one of None, 'balanced', 'weighted' or 'stratified'")
+        self.sampler = sampler
+        self.class_weights = class_weights
+        self.sample_weights = sample_weights
+        self.drawn = 0
+        if self.sampler is not None:
+            self.setup_sampler()
 
-    def next(self):
-        # This function creates a batch of images and corresponding labels and returns them.
-        # In this context a "batch" of images just means a bunch, say 10 images that are forwarded at once.
-        # Note that your amount of total data might not be divisible without remainder with the batch_size.
-        # Think about how to handle such cases
-        
-        batch_images = []
-        batch_labels = []
+        # optional persistent cache of decoded (and resized) samples, so later runs skip decoding completely
+        self.cache_dir = cache_dir
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        # optional in-memory cache bounded by cache_bytes, for datasets which do not fit into memory.
+        # cache_first serves the cached samples first in every new epoch (keeping their shuffled order)
+        self.cache = SampleCache(self.num_images, cache_bytes) if cache_bytes is not None else None
+        self.cache_first = cache_first
+
+        # loading in worker processes: the workers write the batches into a ring of shared memory slots and next()
+        # returns a view of the slot. The slot is recycled with the following call of next(), copy the batch if
+        # it has to live longer. prefetch batches are loaded ahead, every batch is split into tasks of chunk_size
+        # samples (default: one task per batch). See autotune() for picking these values. Samples in the in-memory
+        # cache are served by this process, only the others are loaded by the workers
+        if workers and crop is not None:
+            raise ValueError("crop is not supported when loading with worker processes")
+        self.workers = workers
+        self.prefetch = max(1, prefetch)
+        self.chunk_size = chunk_size
+        self.pool = None
+        self.ring = None
+        self.pending = deque()
+        self.requeued = deque()  # (indices, epoch) of batches which were scheduled but not returned before close()
+        self.handed_out = None
+        self.scheduled_epoch = 0
+
+        # batch level mixing with the Beta(alpha, alpha) parameter, 0 = off. With mixing the labels are returned
+        # as soft one-hot arrays (batch_size, number of classes), otherwise the integer labels stay unchanged.
+        # If both are on, every batch uses one of them at random
+        self.mixup = mixup
+        self.cutmix = cutmix
+
+        # optional loading pipeline (a Pipeline or a list of stages, see default_stages) which replaces the built-in
+        # loading of the samples. It gets the file names of a batch and has to return the batch array; affine and
+        # mixing are still applied on top. The in-memory and disk caches are not used by a pipeline
+        if pipeline is not None and (workers or crop is not None):
+            raise ValueError("pipeline is not supported together with crop or worker processes")
+        self.pipeline = pipeline if pipeline is None or isinstance(pipeline, Pipeline) else Pipeline(pipeline)
+
+        # multi-resolution output: pyramid lists further (smaller) sizes, e.g. [64, 32] or [[64, 64, 3], [32, 32, 3]].
+        # next() then returns a list of batches, image_size first, all derived from the same decoded and augmented
+        # batch (see pyramid_levels), i.e. with the same samples and augmentation decisions
+        self.pyramid = None
+        if pyramid is not None:
+            self.pyramid = [(size, size) + tuple(self.image_size[2:]) if np.isscalar(size) else tuple(size)
+                            for size in pyramid]
+            if any(h > self.image_size[0] or w > self.image_size[1] for h, w in (size[:2] for size in self.pyramid)):
+                raise ValueError("pyramid sizes must not be larger than image_size")
+
+
+    def setup_sampler(self):
+        # per-class index arrays, stored as one index array sorted by class plus offsets and counts per class
+        labels = np.asarray(self.label_array)[self.subset]
+        self.class_positions = np.argsort(labels, kind='stable')  # positions in subset
+        self.class_order = self.subset[self.class_positions]
+        self.class_ids, self.class_counts = np.unique(labels, return_counts=True)
+        self.class_offsets = np.concatenate([[0], np.cumsum(self.class_counts)[:-1]])
 
+        if self.sampler == 'weighted':
+            if self.sample_weights is not None:
+                self.alias_tables = build_alias_table(np.asarray(self.sample_weights)[self.subset])
+            else:
+                # class level tables: P(class) ~ weight * count, then uniform within the class
+                weights = self.class_weights or {c: 1 / n for c, n in zip(self.class_ids, self.class_counts)}
+                self.alias_tables = build_alias_table([weights.get(c, 0) * n for c, n in
+                                                       zip(self.class_ids, self.class_counts)])
+        elif self.sampler == 'stratified':
+            self.indices = self.stratified_order()
+
+    def draw_from_classes(self, classes):
+        # uniform draw within the given classes (positions into class_ids), O(len(classes))
+        pos = self.class_offsets[classes] + (np.random.uniform(size=len(classes)) * self.class_counts[classes]).astype(int)
+        return self.class_order[pos]
+
+    def stratified_order(self):
+        # shuffles every class and interleaves the classes by their relative rank, so that every window of the
+        # epoch (i.e. every batch) contains the classes in about the dataset proportions
+        key = np.empty(len(self.subset))
+        for offset, count in zip(self.class_offsets, self.class_counts):
+            members = self.class_positions[offset:offset + count]
+            key[np.random.permutation(members)] = (np.arange(count) + np.random.uniform(size=count)) / count
+        return list(self.subset[np.argsort(key, kind='stable')])
+
+    def next_indices(self):
+        # returns the dataset indices of the next batch and keeps track of the epoch
+        if self.requeued:
+            indices, self.epoch = self.requeued.popleft()
+            return indices
+        if self.sampler in ('balanced', 'weighted'):
+            if self.sampler == 'balanced':
+                classes = np.resize(np.random.permutation(len(self.class_ids)), self.batch_size)
+                batch_indices = self.draw_from_classes(classes)
+            elif self.sample_weights is not None:
+                batch_indices = self.subset[alias_draw(*self.alias_tables, self.batch_size)]
+            else:
+                batch_indices = self.draw_from_classes(alias_draw(*self.alias_tables, self.batch_size))
+            # an epoch is over once as many samples as the dataset has were drawn
+            self.drawn += self.batch_size
+            self.epoch = self.drawn // len(self.subset)
+            return list(batch_indices)
+
+        batch_indices = []
         for _ in range(self.batch_size):
-            if self.current_index >= len(self.image_files):
+            if self.current_index >= len(self.indices):
                 print("We have reached the end of the dataset, i.e. completed an epoch.")
 
                 # reset the index to 0 so we can start from the beginning of the dataset
@@ -85,21 +1206,220 @@ class ImageGenerator:
 
                 # if self.shuffle:
                 #     random.shuffle(self.indices)
-                
+                if self.sampler == 'stratified':
+                    self.indices = self.stratified_order()
+                if self.cache_first and self.cache is not None:
+                    self.indices = self.cached_first(self.indices)
 
-            img_name = self.image_files[self.indices[self.current_index]]
-            img_path = os.path.join(self.file_path, img_name)
-            image = io.imread(img_path)
+            batch_indices.append(self.indices[self.current_index])
+            self.current_index += 1
+        return batch_indices
 
-            # skimage.transform.resize (=! reshape)
-            image = resize(image=image, output_shape=self.image_size) #, mode='reflect', anti_aliasing=True)
+    def cached_first(self, indices):
+        # stable reordering: cached samples first, both groups keep their order
+        indices = np.asarray(indices)
+        cached = self.cache.cached(indices)
+        return list(np.concatenate([indices[cached], indices[~cached]]))
 
-            
-            label = self.labels[img_name]
+    def sample(self, index):
+        # sample by index, served from the in-memory cache if possible
+        if self.cache is None:
+            return self.load_sample(self.image_files[index])
+        image = self.cache.get(index)
+        if image is None:
+            image = np.asarray(self.load_sample(self.image_files[index]))
+            self.cache.put(index, image)
+        return image
+
+    def load_sample(self, img_name):
+        # reads the image with the reader of its file type and resizes it to image_size. With crop augmentation
+        # the decoded image is returned as it is, the crop does its own resampling
+        image_size = None if self.crop is not None else tuple(self.image_size)
+        return load_sample(os.path.join(self.file_path, img_name), image_size, self.cache_dir)
+
+    def next_from_workers(self):
+        # worker process variant of next()
+        if self.pool is None:
+            self.ring = SharedBatchRing(self.prefetch + 1, [self.batch_size] + list(self.image_size))
+            self.pool = start_pool(self.workers)
+        if self.handed_out is not None:
+            self.ring.release(self.handed_out)
+            self.handed_out = None
+
+        # batches are scheduled ahead, so the epoch counter of the scheduling runs ahead of the returned batches
+        consumed_epoch, self.epoch = self.epoch, self.scheduled_epoch
+        while len(self.pending) < self.prefetch:
+            indices = self.next_indices()
+            slot = self.ring.acquire()
+            # samples in the in-memory cache are copied into the slot here, the workers only load the others
+            load = []
+            for position, index in enumerate(indices):
+                sample = self.cache.get(index) if self.cache is not None else None
+                if sample is None:
+                    load.append(position)
+                else:
+                    self.ring.view(slot)[position] = sample
+            paths = [os.path.join(self.file_path, self.image_files[indices[p]]) for p in load]
+            chunk = self.chunk_size or max(1, len(paths))
+            futures = [self.pool.submit(fill_slot, self.ring.spec(), slot, paths[i:i + chunk], tuple(self.image_size),
+                                        self.cache_dir, load[i:i + chunk]) for i in range(0, len(paths), chunk)]
+            self.pending.append((futures, slot, indices, self.epoch, load))
+        self.scheduled_epoch, self.epoch = self.epoch, consumed_epoch
+
+        futures, slot, indices, epoch, load = self.pending.popleft()
+        try:
+            # all chunks have to be done before the slot may be reused, also if one of them failed
+            wait(futures)
+            for future in futures:
+                future.result()
+        except BaseException:
+            self.ring.release(slot)
+            raise
+        self.epoch = epoch
+        self.handed_out = slot
+
+        images = self.ring.view(slot)
+        if self.cache is not None:
+            for position in load:
+                self.cache.put(indices[position], images[position])
+        labels = np.asarray(self.label_array[indices])
+        if self.affine is not None:
+            images = self.affine_batch(images)
+        if self.mixup or self.cutmix:
+            images, labels = self.mix_batch(images, labels)
+        return images, labels
+
+    def close(self):
+        # stops the worker processes and frees the shared memory
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        # the indices of the batches in flight were already drawn, they are returned by the following calls of next()
+        self.requeued.extend((indices, epoch) for _, _, indices, epoch, _ in self.pending)
+        self.pending.clear()
+        self.handed_out = None
+
+    # settings a view may change, everything else (file list, labels, caches, crop) is shared with the generator
+    view_settings = {'batch_size', 'shuffle', 'rotation', 'mirroring', 'affine', 'mixup', 'cutmix', 'sampler',
+                     'class_weights', 'cache_first', 'workers', 'prefetch', 'chunk_size'}
+
+    def view(self, indices, **settings):
+        """
+        Creates a lightweight generator over a subset of the dataset.
+
+        The view shares the file list, the labels, the in-memory and the disk cache with this generator, so the
+        samples are loaded and cached only once for all views. It has its own index order, epoch counter and worker
+        processes, and settings (see view_settings, e.g. shuffle=False, mirroring=False) override the ones of
+        this generator.
+
+        The settings are checked like in __init__, e.g. workers=2 is rejected for a generator with crop or pipeline.
+
+        Parameters:
+            indices: dataset indices (positions in image_files) of the view, at least one
+
+        Returns:
+            ImageGenerator: the view
+        """
+        unknown = set(settings) - self.view_settings
+        if unknown:
+            raise ValueError("A view cannot change {}".format(", ".join(sorted(unknown))))
+        if len(indices) == 0:
+            raise ValueError("A view needs at least one sample")
+        view = copy.copy(self)
+        for name, value in settings.items():
+            setattr(view, name, value)
+        if view.sampler not in (None, 'balanced', 'weighted', 'stratified'):
+            raise ValueError("sampler must be one of None, 'balanced', 'weighted' or 'stratified'")
+        if view.affine is not None and not set(view.affine) <= {'rotation', 'scale', 'shear', 'translate'}:
+            raise ValueError("affine only supports the keys 'rotation', 'scale', 'shear' and 'translate'")
+        if view.workers and view.crop is not None:
+            raise ValueError("crop is not supported when loading with worker processes")
+        if view.workers and view.pipeline is not None:
+            raise ValueError("pipeline is not supported together with crop or worker processes")
+        view.prefetch = max(1, view.prefetch)
+        view.pool, view.ring, view.pending, view.handed_out, view.scheduled_epoch = None, None, deque(), None, 0
+        view.requeued = deque()
+        view.epoch, view.current_index, view.drawn = 0, 0, 0
+
+        view.subset = np.asarray(indices, dtype=np.int64)
+        view.indices = list(view.subset)
+        if view.shuffle:
+            random.shuffle(view.indices)
+        if view.sampler is not None:
+            view.setup_sampler()
+        return view
+
+    def split(self, ratio=None, ids=None, folds=None, fold=0, seed=None, train_settings=None, val_settings=None):
+        """
+        Splits the dataset into a training and a validation view (see view()), by one of
+            ratio: share of the training samples, e.g. 0.8
+            ids: the ids (file names or their stems, e.g. 45 or "45.npy") of the validation samples
+            folds, fold: k-fold split, the validation samples are the fold-th of the folds parts
+        The split by ratio and by folds is random with the given seed. The validation view is by default neither
+        shuffled nor augmented, train_settings and val_settings override the settings of the views. A split which
+        leaves one of the views empty (e.g. ratio=1.0) raises a ValueError.
+
+        Returns:
+            tuple: training view and validation view
+        """
+        if sum(option is not None for option in (ratio, ids, folds)) != 1:
+            raise ValueError("Split by exactly one of ratio, ids or folds")
+        indices = np.asarray(self.subset)
+        if ids is not None:
+            position = {}
+            for i, name in zip(indices, (self.image_files[i] for i in indices)):
+                position[name] = position[os.path.splitext(name)[0]] = i
+            missing = [sample_id for sample_id in ids if str(sample_id) not in position]
+            if missing:
+                raise KeyError("Unknown ids: {}".format(missing[:10]))
+            val = np.unique([position[str(sample_id)] for sample_id in ids])
+        else:
+            order = np.random.RandomState(seed).permutation(indices)
+            if ratio is not None:
+                val = order[int(round(ratio * len(order))):]
+            else:
+                if not 0 <= fold < folds:
+                    raise ValueError("fold must be in [0, folds)")
+                val = np.array_split(order, folds)[fold]
+            val = np.sort(val)
+        train = indices[~np.isin(indices, val)]
+        if len(train) == 0 or len(val) == 0:
+            raise ValueError("The split leaves the {} view empty".format('training' if len(train) == 0 else 'validation'))
+
+        val_defaults = {'shuffle': False, 'rotation': False, 'mirroring': False, 'affine': None, 'mixup': 0,
+                        'cutmix': 0, 'sampler': None}
+        return self.view(train, **(train_settings or {})), self.view(val, **dict(val_defaults, **(val_settings or {})))
+
+    def next(self):
+        # returns the next (images, labels). With pyramid sizes, images is a list of aligned batches
+        images, labels = self.next_batch()
+        if self.pyramid is not None:
+            images = pyramid_levels(images, self.pyramid)
+        return images, labels
+
+    def next_batch(self):
+        # This function creates a batch of images and corresponding labels and returns them.
+        # In this context a "batch" of images just means a bunch, say 10 images that are forwarded at once.
+        # Note that your amount of total data might not be divisible without remainder with the batch_size.
+        # Think about how to handle such cases
+        if self.workers:
+            return self.next_from_workers()
+        if self.pipeline is not None:
+            return self.next_from_pipeline()
+
+        batch_images = []
+        batch_labels = []
+
+        for index in self.next_indices():
+            image = self.sample(index)
+
+            label = self.label_array[index]
 
             batch_images.append(image)
             batch_labels.append(label)
-            self.current_index += 1
 
         ### 
 
@@ -143,8 +1463,167 @@ class ImageGenerator:
         #     self.index += 1
         #     count += 1
 
+        if self.crop is not None:
+            images = self.crop_batch(batch_images)
+        else:
+            images = np.array(batch_images)
+
+        if self.affine is not None:
+            images = self.affine_batch(images)
+
+        if self.mixup or self.cutmix:
+            return self.mix_batch(images, np.array(batch_labels))
+
         # return a tuple of (images, labels)
-        return np.array(batch_images), np.array(batch_labels) # or ( np.array(batch_images), np.array(batch_labels) )?
+        return images, np.array(batch_labels) # or ( np.array(batch_images), np.array(batch_labels) )?
+
+    def next_from_pipeline(self):
+        # pipeline variant of next()
+        indices = self.next_indices()
+        images = self.pipeline([self.image_files[i] for i in indices])
+        labels = np.asarray(self.label_array[indices])
+        if self.affine is not None:
+            images = self.affine_batch(images)
+        if self.mixup or self.cutmix:
+            images, labels = self.mix_batch(images, labels)
+        return images, labels
+
+    def default_stages(self):
+        # the stages of a pipeline corresponding to the settings of the generator
+        stages = [Read(self.file_path), Decode(), Resize(self.image_size)]
+        if self.mirroring:
+            stages.append(Mirror())
+        if self.rotation:
+            stages.append(Rotate90())
+        return stages + [Batch()]
+
+    def mix_batch(self, images, labels):
+        """
+        Applies MixUp or CutMix to a whole batch at once.
+
+        Every sample is paired with the sample at the same position of one random permutation of the batch.
+        MixUp blends the two images with a per-sample lambda, CutMix pastes a box of the partner, the boxes of
+        all samples are built as one boolean mask. The labels are mixed with the same (area) ratio.
+
+        Returns:
+            tuple: mixed images (B, H, W, C) and soft labels (B, number of classes)
+        """
+        n = len(images)
+        use_cutmix = self.cutmix and (not self.mixup or np.random.uniform() < 0.5)
+        alpha = self.cutmix if use_cutmix else self.mixup
+        lam = np.random.beta(alpha, alpha, size=n)
+        perm = np.random.permutation(n)
+        partner = images[perm]
+
+        if use_cutmix:
+            height, width = images.shape[1:3]
+            cut_h = np.round(height * np.sqrt(1 - lam)).astype(int)
+            cut_w = np.round(width * np.sqrt(1 - lam)).astype(int)
+            cy = np.random.randint(height, size=n)
+            cx = np.random.randint(width, size=n)
+            top, bottom = np.clip(cy - cut_h // 2, 0, height), np.clip(cy + (cut_h + 1) // 2, 0, height)
+            left, right = np.clip(cx - cut_w // 2, 0, width), np.clip(cx + (cut_w + 1) // 2, 0, width)
+            rows = np.arange(height)
+            cols = np.arange(width)
+            in_rows = (rows >= top[:, None]) & (rows < bottom[:, None])
+            in_cols = (cols >= left[:, None]) & (cols < right[:, None])
+            box = in_rows[:, :, None] & in_cols[:, None, :]
+            images = np.where(box[..., None], partner, images)
+            # the actual share of the own image after clipping the boxes
+            lam = 1 - (bottom - top) * (right - left) / (height * width)
+        else:
+            weight = lam.reshape((-1,) + (1,) * (images.ndim - 1))
+            images = weight * images + (1 - weight) * partner
+
+        one_hot = np.eye(len(self.class_dict))[labels]
+        soft_labels = lam[:, None] * one_hot + (1 - lam[:, None]) * one_hot[perm]
+        return images, soft_labels
+
+    def affine_matrices(self, n):
+        # draws n random forward transforms, returns the 2x2 linear parts (n, 2, 2) and translations (n, 2)
+        rotation = np.deg2rad(self.affine.get('rotation', 0))
+        shear = np.deg2rad(self.affine.get('shear', 0))
+        scale = self.affine.get('scale', (1, 1))
+        translate = self.affine.get('translate', 0)
+
+        theta = np.random.uniform(-rotation, rotation, size=n)
+        phi = np.random.uniform(-shear, shear, size=n)
+        s = np.random.uniform(scale[0], scale[1], size=n)
+        cos, sin = np.cos(theta), np.sin(theta)
+
+        # rotation @ shear (along x) @ isotropic scale
+        linear = np.empty((n, 2, 2))
+        linear[:, 0, 0] = cos * s
+        linear[:, 0, 1] = (cos * np.tan(phi) - sin) * s
+        linear[:, 1, 0] = sin * s
+        linear[:, 1, 1] = (sin * np.tan(phi) + cos) * s
+
+        size = np.array(self.image_size[1::-1], dtype=np.float64)  # (width, height)
+        shift = np.random.uniform(-translate, translate, size=(n, 2)) * size
+        return linear, shift
+
+    def affine_batch(self, images):
+        # applies a random affine transform to every image of the batch. The sampling coordinates of the whole
+        # batch are computed from the cached base grid with one matrix product and sampled with one gather
+        n, height, width = images.shape[:3]
+        linear, shift = self.affine_matrices(n)
+
+        # output -> source: inverse(linear) @ (p - shift), then back to pixel coordinates
+        base = affine_base_grid(height, width)
+        coords = np.linalg.inv(linear) @ (base[None] - shift[:, :, None])
+        xs = coords[:, 0].reshape(n, height, width) + (width - 1) / 2
+        ys = coords[:, 1].reshape(n, height, width) + (height - 1) / 2
+        return bilinear_gather(images, ys, xs)
+
+    def crop_windows(self, n, height, width):
+        # computes the source windows (top, left, height, width) of n images of the given size, vectorized
+        out_h, out_w = self.image_size[:2]
+        if self.crop == 'random_resized':
+            area = height * width * np.random.uniform(*self.crop_scale, size=n)
+            log_ratio = np.random.uniform(np.log(self.crop_ratio[0]), np.log(self.crop_ratio[1]), size=n)
+            ratio = np.exp(log_ratio)
+            win_h = np.clip(np.sqrt(area / ratio), 1, height)
+            win_w = np.clip(np.sqrt(area * ratio), 1, width)
+        else:
+            crop_h, crop_w = self.crop_size[:2] if self.crop_size is not None else (out_h, out_w)
+            win_h = np.full(n, float(min(crop_h, height)))
+            win_w = np.full(n, float(min(crop_w, width)))
+
+        if self.crop == 'center':
+            top = (height - win_h) / 2
+            left = (width - win_w) / 2
+        else:
+            top = np.random.uniform(size=n) * (height - win_h)
+            left = np.random.uniform(size=n) * (width - win_w)
+        return top, left, win_h, win_w
+
+    def crop_batch(self, images):
+        # crops a window from every (raw, not resized) image and resamples only this window to image_size.
+        # Every run of consecutive images of the same shape is processed as one vectorized gather, straight into
+        # its slice of the output batch
+        out_h, out_w = self.image_size[:2]
+        channels = self.image_size[2] if len(self.image_size) > 2 else 1
+        batch = np.empty((len(images), out_h, out_w, channels))
+
+        start = 0
+        while start < len(images):
+            shape = images[start].shape
+            stop = start + 1
+            while stop < len(images) and images[stop].shape == shape:
+                stop += 1
+            raw = np.stack(images[start:stop]).reshape(stop - start, shape[0], shape[1], -1)
+            top, left, win_h, win_w = self.crop_windows(stop - start, shape[0], shape[1])
+
+            # pixel centers of the output grid mapped into the source window
+            ys = top[:, None] + (np.arange(out_h) + 0.5) * (win_h / out_h)[:, None] - 0.5
+            xs = left[:, None] + (np.arange(out_w) + 0.5) * (win_w / out_w)[:, None] - 0.5
+            bilinear_gather(raw, ys[:, :, None], xs[:, None, :], out=batch[start:stop])
+
+            # same value range as skimage's resize, i.e. integer images are mapped to [0, 1]
+            if np.issubdtype(raw.dtype, np.integer):
+                batch[start:stop] /= np.iinfo(raw.dtype).max
+            start = stop
+        return batch
 
 
     def augment(self,img):
@@ -159,6 +1638,167 @@ class ImageGenerator:
 
         return img
 
+    def fingerprint(self):
+        # identifies the version of the dataset: names, sizes and modification times of all files and the labels
+        h = hashlib.sha1(str(self.image_size).encode())
+        if self.manifest is not None:
+            # the manifest already holds names, sizes and modification times (and the labels)
+            h.update(np.ascontiguousarray(self.manifest).tobytes())
+            return h.hexdigest()
+        for name in self.image_files:
+            st = os.stat(os.path.join(self.file_path, name))
+            h.update("{}|{}|{};".format(name, st.st_size, st.st_mtime_ns).encode())
+        st = os.stat(self.label_path)
+        h.update("labels|{}|{}".format(st.st_size, st.st_mtime_ns).encode())
+        return h.hexdigest()
+
+    def stats_path(self):
+        # e.g. data/Labels_stats.json next to data/Labels.json
+        return os.path.splitext(self.label_path)[0] + '_stats.json'
+
+    def compute_stats(self, chunk_size=1024, threads=None, refresh=False):
+        """
+        Computes per-channel mean, std, min and max of the (resized, not augmented) samples and the class histogram.
+
+        The dataset is streamed in chunks of chunk_size samples. Every chunk is reduced on its own by a pool of
+        threads and the partial results are merged in a numerically stable way (Welford/Chan), so the whole dataset
+        is never in memory at once. The result is cached next to the labels file, keyed by the dataset fingerprint,
+        and only computed again when the dataset changes (or with refresh=True).
+
+        Returns:
+            dict: 'count', 'mean', 'std', 'min', 'max' (per channel), 'class_histogram' and 'fingerprint'
+        """
+        fingerprint = self.fingerprint()
+        cached = {}
+        if os.path.exists(self.stats_path()):
+            with open(self.stats_path(), 'r') as f:
+                cached = json.load(f)
+            if fingerprint in cached and not refresh:
+                return cached[fingerprint]
+
+        def reduce_chunk(names):
+            images = np.stack([np.asarray(self.load_sample(name)) for name in names])
+            if np.issubdtype(images.dtype, np.integer):
+                images = images / np.iinfo(images.dtype).max
+            return chunk_stats(images)
+
+        chunks = [self.image_files[i:i + chunk_size] for i in range(0, len(self.image_files), chunk_size)]
+        total = None
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for part in pool.map(reduce_chunk, chunks):
+                total = part if total is None else merge_stats(total, part)
+        count, mean, m2, minimum, maximum = total
+
+        labels = np.asarray(self.label_array)
+        stats = {'count': int(count), 'mean': mean.tolist(), 'std': np.sqrt(m2 / count).tolist(),
+                 'min': minimum.tolist(), 'max': maximum.tolist(),
+                 'class_histogram': np.bincount(labels, minlength=len(self.class_dict)).tolist(),
+                 'fingerprint': fingerprint}
+
+        cached[fingerprint] = stats
+        tmp = self.stats_path() + '.{}.tmp'.format(os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(cached, f, indent=1)
+        os.replace(tmp, self.stats_path())
+        return stats
+
+    def tune_path(self):
+        # e.g. data/Labels_tune.json next to data/Labels.json
+        return os.path.splitext(self.label_path)[0] + '_tune.json'
+
+    def probe(self, config, batches=4):
+        """
+        Measures the throughput of the loader with the given workers/prefetch/chunk_size on a copy of the generator
+        (after one warm-up batch, which includes starting the workers). The state of random and np.random is
+        restored afterwards and the output of the probe is discarded, so the generator itself is not affected.
+
+        Returns:
+            tuple: samples per second and estimated memory in bytes (batches in flight plus peak memory of the workers)
+        """
+        gen = copy.copy(self)
+        gen.workers, gen.prefetch, gen.chunk_size = config['workers'], config['prefetch'], config['chunk_size']
+        gen.pool, gen.ring, gen.pending, gen.handed_out, gen.scheduled_epoch = None, None, deque(), None, gen.epoch
+        gen.requeued = deque()
+        gen.cache = None  # the probes must not fill (or be served from) the in-memory cache
+        random_state, np_random_state = random.getstate(), np.random.get_state()
+        try:
+            with contextlib.redirect_stdout(StringIO()):
+                return gen.measure(batches)
+        finally:
+            gen.close()
+            random.setstate(random_state)
+            np.random.set_state(np_random_state)
+
+    def measure(self, batches):
+        # throughput and memory estimate of the loader settings of this generator, see probe()
+        self.next()
+        start = time.perf_counter()
+        for _ in range(batches):
+            self.next()
+        rate = batches * self.batch_size / (time.perf_counter() - start)
+
+        batch_bytes = self.batch_size * int(np.prod(self.image_size)) * np.dtype(np.float64).itemsize
+        memory = (self.prefetch + 1) * batch_bytes if self.workers else batch_bytes
+        if self.workers:
+            memory += self.workers * max(self.pool.map(worker_memory, range(self.workers)))
+        return rate, memory
+
+    def autotune(self, memory_budget=None, probe_batches=4, max_workers=None, max_steps=10, refresh=False):
+        """
+        Picks workers, prefetch and chunk_size for this host and dataset and applies them to the generator.
+
+        Starting from the current configuration, every step probes the neighbouring configurations (see
+        loader_neighbours) with short runs and moves to the fastest one within memory_budget (bytes, None = no limit),
+        as long as it is more than 5% faster. If nothing fits into the budget, the current configuration is kept.
+        The result is stored next to the labels file, keyed by the host, the dataset fingerprint and the batch size,
+        and reused without probing (unless refresh=True).
+
+        Returns:
+            dict: 'workers', 'prefetch', 'chunk_size', 'samples_per_second' and 'memory'
+        """
+        if self.crop is not None or self.pipeline is not None:
+            raise ValueError("autotune only supports the built-in loading without crop")
+        key = "{}|{}|{}".format(host_key(), self.fingerprint(), self.batch_size)
+        tuned = {}
+        if os.path.exists(self.tune_path()):
+            with open(self.tune_path(), 'r') as f:
+                tuned = json.load(f)
+
+        if key not in tuned or refresh:
+            max_workers = os.cpu_count() if max_workers is None else max_workers
+            config = {'workers': min(self.workers, max_workers), 'prefetch': self.prefetch,
+                      'chunk_size': min(self.chunk_size or self.batch_size, self.batch_size)}
+            probed = {}
+
+            def score(config):
+                # samples per second, or -inf if over the memory budget
+                name = (config['workers'], config['prefetch'], config['chunk_size'])
+                if name not in probed:
+                    probed[name] = self.probe(config, probe_batches)
+                rate, memory = probed[name]
+                return rate if memory_budget is None or memory <= memory_budget else -np.inf
+
+            best = score(config)
+            for _ in range(max_steps):
+                scored = [(score(candidate), candidate) for candidate in loader_neighbours(config, max_workers,
+                                                                                         self.batch_size)]
+                rate, candidate = max(scored, key=lambda item: item[0], default=(-np.inf, None))
+                if candidate is None or rate <= 1.05 * best:
+                    break
+                best, config = rate, candidate
+
+            rate, memory = probed[(config['workers'], config['prefetch'], config['chunk_size'])]
+            tuned[key] = dict(config, samples_per_second=rate, memory=int(memory))
+            tmp = self.tune_path() + '.{}.tmp'.format(os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(tuned, f, indent=1)
+            os.replace(tmp, self.tune_path())
+
+        result = tuned[key]
+        self.close()
+        self.workers, self.prefetch, self.chunk_size = result['workers'], result['prefetch'], result['chunk_size']
+        return result
+
     def current_epoch(self):
         # return the current epoch number
         return self.epoch
@@ -169,11 +1809,15 @@ class ImageGenerator:
         return self.class_dict.get(int_label)       
 
 
-    def show(self):
+    def show(self, batch=None):
         # In order to verify that the generator creates batches as required, this functions calls next to get a
         # batch of images and labels and visualizes it.
+        # Pass an already fetched (images, labels) batch to show it without advancing the generator. For headless,
+        # non-blocking exports use montage/export_image or a BatchExporter instead
 
-        images, labels = self.next()  # Generate a batch
+        images, labels = self.next() if batch is None else batch  # Generate a batch
+        if isinstance(images, list):
+            images = images[0]  # pyramid output, show the largest level
 
         batch_size = len(images)
         cols = min(5, batch_size)  # Display 5 images per row max
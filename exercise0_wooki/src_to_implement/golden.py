@@ -0,0 +1,115 @@
+import os
+import json
+import hashlib
+from argparse import ArgumentParser
+import numpy as np
+
+
+# Golden outputs of the patterns. Instead of keeping full reference arrays for every parameter set, the store only
+# keeps a content hash of the draw() output (plus an optional small preview for eyeballing a mismatch).
+# Regenerate the store after an intended change of a pattern with:  python golden.py --update
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference_arrays', 'goldens.json')
+
+# pattern class name, constructor parameters, decimals used for rounding before hashing (None = exact bytes)
+GOLDEN_CASES = [("Checker", {"resolution": 250, "tile_size": 25}, None),
+                ("Checker", {"resolution": 100, "tile_size": 25}, None),
+                ("Circle", {"resolution": 1024, "radius": 200, "position": [512, 256]}, None),
+                ("Circle", {"resolution": 512, "radius": 20, "position": [50, 50]}, None),
+                ("Spectrum", {"resolution": 255}, 6),
+                ("Spectrum", {"resolution": 100}, 6)]
+
+
+def golden_key(class_name, params):
+    # e.g. "Checker(resolution=250, tile_size=25)"
+    return "{}({})".format(class_name, ", ".join("{}={}".format(k, params[k]) for k in sorted(params)))
+
+
+def digest(array, decimals=None, chunk_rows=256):
+    """
+    Computes the sha256 digest of an array in a streaming fashion.
+
+    The array is fed to the hash block by block (chunk_rows rows at a time), so only one block is ever copied.
+    Shape and dtype are part of the digest. For float outputs `decimals` rounds every block first, so that
+    differences in the last bits (e.g. between platforms) do not change the digest.
+
+    Returns:
+        str: hex digest
+    """
+    array = np.asarray(array)
+    h = hashlib.sha256("{}|{}".format(array.dtype.str, array.shape).encode())
+    rows = array.reshape(array.shape[0], -1) if array.ndim > 1 else array.reshape(-1, 1)
+    for start in range(0, rows.shape[0], chunk_rows):
+        block = np.ascontiguousarray(rows[start:start + chunk_rows])
+        if decimals is not None:
+            # + 0.0 turns -0.0 into 0.0, both would hash differently otherwise
+            block = np.round(block, decimals) + 0.0
+        h.update(memoryview(block).cast('B'))
+    return h.hexdigest()
+
+
+def preview(array, size=16):
+    # downsampled version of the output (every n-th pixel) with at most size x size pixels
+    array = np.asarray(array)
+    step = max(1, -(-array.shape[0] // size))
+    return array[::step, ::step].tolist()
+
+
+def load_goldens(golden_file=GOLDEN_FILE):
+    if not os.path.exists(golden_file):
+        return {}
+    with open(golden_file, 'r') as f:
+        return json.load(f)
+
+
+def render(class_name, params):
+    # draws the pattern for the given parameters and returns its output
+    import pattern
+    kwargs = dict(params)
+    if "position" in kwargs:
+        kwargs["position"] = tuple(kwargs["position"])
+    return getattr(pattern, class_name)(**kwargs).draw()
+
+
+def check(class_name, params, output, goldens=None):
+    """
+    Compares an output with the stored golden of the given pattern parameters.
+
+    Returns:
+        bool: True if the digests match, False if they differ or no golden is stored for the parameters
+    """
+    goldens = load_goldens() if goldens is None else goldens
+    golden = goldens.get(golden_key(class_name, params))
+    if golden is None:
+        return False
+    return golden["digest"] == digest(output, decimals=golden["decimals"])
+
+
+def update(cases=GOLDEN_CASES, golden_file=GOLDEN_FILE, with_preview=False):
+    # regenerates all given cases and writes their digests to the store (other entries are kept)
+    goldens = load_goldens(golden_file)
+    for class_name, params, decimals in cases:
+        output = render(class_name, params)
+        entry = {"digest": digest(output, decimals=decimals), "decimals": decimals,
+                 "shape": list(output.shape), "dtype": output.dtype.str}
+        if with_preview:
+            entry["preview"] = preview(output)
+        goldens[golden_key(class_name, params)] = entry
+    with open(golden_file, 'w') as f:
+        json.dump(goldens, f, indent=1, sort_keys=True)
+    return goldens
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Checks the pattern outputs against the golden store or updates it")
+    parser.add_argument("--update", action="store_true", help="regenerate and store all goldens")
+    parser.add_argument("--preview", action="store_true", help="also store a downsampled preview")
+    args = parser.parse_args()
+
+    if args.update:
+        update(with_preview=args.preview)
+        print("Updated {} goldens in {}".format(len(GOLDEN_CASES), GOLDEN_FILE))
+    else:
+        goldens = load_goldens()
+        for class_name, params, decimals in GOLDEN_CASES:
+            ok = check(class_name, params, render(class_name, params), goldens)
+            print("{:50s} {}".format(golden_key(class_name, params), "OK" if ok else "MISMATCH"))
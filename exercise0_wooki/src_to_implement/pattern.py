@@ -1,5 +1,110 @@
+from collections import OrderedDict
 import numpy as np
 import matplotlib.pyplot as plt
+import matplotlib.image
+
+# size of the blocks the 'blocked' draw backends work on, small enough to stay in the CPU cache
+BLOCK_BYTES = 1 << 18
+
+# byte budget of the cached distance fields, least recently used first out. A larger field is not cached at all
+DISTANCE_CACHE_BYTES = 1 << 28
+_distance_fields = OrderedDict()
+
+
+def distance_field(resolution: int, x_center, y_center):
+    """
+    Euclidean distance of every pixel to the center, as read-only float32 array of shape (resolution, resolution).
+
+    Cached per (resolution, center) within DISTANCE_CACHE_BYTES, so masks for any radius of the same center are a
+    single comparison. Fields above the budget (e.g. 4 GB at 32k) are recomputed for every call instead.
+    The squared distances are summed in float64 from the two per-axis vectors before the square root,
+    which keeps thresholds identical to draw() for resolutions up to a few thousand pixels.
+    """
+    key = (resolution, x_center, y_center)
+    if key in _distance_fields:
+        _distance_fields.move_to_end(key)
+        return _distance_fields[key]
+
+    dist = np.add(((np.arange(resolution) - x_center)**2)[None, :], ((np.arange(resolution) - y_center)**2)[:, None],
+                  dtype=np.float64)
+    dist = np.sqrt(dist, out=dist).astype(np.float32)
+    dist.flags.writeable = False
+    if dist.nbytes <= DISTANCE_CACHE_BYTES:
+        _distance_fields[key] = dist
+        while sum(field.nbytes for field in _distance_fields.values()) > DISTANCE_CACHE_BYTES:
+            _distance_fields.popitem(last=False)
+    return dist
+
+
+def row_blocks(rows: int, row_bytes: int):
+    # slices of rows such that one block of temporaries has about BLOCK_BYTES
+    step = max(1, BLOCK_BYTES // max(1, row_bytes))
+    return [slice(start, min(start + step, rows)) for start in range(0, rows, step)]
+
+class CheckerView:
+    def __init__(self, tile_size: int, shape: tuple, offset: tuple = (0, 0), dtype=np.float64):
+        """
+        Read-only virtual checkerboard, backed only by one period of 2 x 2 tiles (O(tile_size**2) memory).
+
+        Parameters:
+            tile_size: number of pixels an individual tile has in each dimension
+            shape: (height, width) of the canvas, does not have to be square or divisible by 2*tile_size
+            offset: (row, column) of the board at which the canvas starts, partial tiles at the edges are fine
+
+        Indexing (e.g. view[10:20, :]) only computes the requested pixels, periods() gives a zero-copy
+        strided view of the repeated period and materialize() returns the contiguous array.
+        """
+        self.tile_size = tile_size
+        self.shape = tuple(shape)
+        self.offset = tuple(offset)
+        i = np.arange(2 * tile_size) // tile_size
+        self.period = ((i[:, None] + i[None, :]) % 2).astype(dtype)
+        self.period.flags.writeable = False
+
+    @property
+    def dtype(self):
+        return self.period.dtype
+
+    @property
+    def ndim(self):
+        return 2
+
+    def periods(self):
+        """
+        Zero-copy view of the period repeated over the canvas, shape (periods_y, 2*tile_size, periods_x, 2*tile_size).
+
+        The board starts at (offset % (2*tile_size)) of the first period, the last periods may reach past the canvas.
+        """
+        p = 2 * self.tile_size
+        ny = -(-(self.offset[0] % p + self.shape[0]) // p)
+        nx = -(-(self.offset[1] % p + self.shape[1]) // p)
+        s0, s1 = self.period.strides
+        return np.lib.stride_tricks.as_strided(self.period, shape=(ny, p, nx, p), strides=(0, s0, 0, s1),
+                                               writeable=False)
+
+    def pixels(self, rows, cols):
+        # gathers the pixels at the given canvas rows and columns (index arrays or scalars) from the period
+        p = 2 * self.tile_size
+        rows = (np.asarray(rows) + self.offset[0]) % p
+        cols = (np.asarray(cols) + self.offset[1]) % p
+        if rows.ndim == 1 and cols.ndim == 1:
+            return self.period[np.ix_(rows, cols)]
+        return self.period[rows, cols]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (2 - len(key))
+        return self.pixels(np.arange(self.shape[0])[key[0]], np.arange(self.shape[1])[key[1]])
+
+    def materialize(self):
+        # the whole canvas as contiguous array
+        return self.pixels(np.arange(self.shape[0]), np.arange(self.shape[1]))
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.materialize()
+        return array if dtype is None else array.astype(dtype)
+
 
 class Checker:
     def __init__(self, resolution: int, tile_size: int):
@@ -19,7 +124,7 @@ class Checker:
         self.tile_size = tile_size
         self.output = None
 
-    def draw(self):
+    def draw(self, encoding=None, virtual=False):
         """
         Creates a checkerboard pattern with the given resolution and tile size.
 
@@ -28,15 +133,29 @@ class Checker:
         expands the pattern to the specified resolution by repeating and resizing the 
         tiles accordingly.
 
+        With encoding='packed' (PackedMask, 8 pixels per byte) or encoding='rle' (RunLengthMask) the
+        pattern is rendered directly in the encoded form, without the dense array. The encoded mask is
+        stored in `encoded`, `output` stays untouched.
+
+        With virtual=True a read-only CheckerView of the board is returned instead (see view()),
+        the resolution does not have to be divisible by 2*tile_size then.
+
         Returns:
             np.ndarray: A numpy array representing the full checkerboard pattern, 
                         where each tile is expanded to the specified pixel size.
         """
 
+        if virtual:
+            return self.view()
+
         # resolution must be evenly dividable by 2*tile_size
         if self.resolution % (2*self.tile_size) != 0:
             raise ValueError("The resolution must be divisible by 2*tile_size") 
 
+        if encoding is not None:
+            self.encoded = self.draw_encoded(encoding)
+            return self.encoded.copy()
+
         # create a 2x2 checkerboard pattern, with top left corner being black, i.e. 0 (not 1 in grayscale)
         pattern = np.array([[0, 1], [1, 0]]) 
         
@@ -48,6 +167,45 @@ class Checker:
         self.output = np.kron(checker_tiles, np.ones((self.tile_size, self.tile_size)))
         return self.output.copy()
 
+    def view(self, shape=None, offset=(0, 0)):
+        """
+        Virtual checkerboard backed by a single 2-tile period, see CheckerView.
+
+        Parameters:
+            shape: (height, width) of the canvas, by default (resolution, resolution)
+            offset: (row, column) of the board at which the canvas starts
+
+        Returns:
+            CheckerView: read-only view, call .materialize() for a contiguous array
+        """
+        shape = (self.resolution, self.resolution) if shape is None else shape
+        return CheckerView(self.tile_size, shape, offset)
+
+    def draw_encoded(self, encoding: str):
+        """
+        Renders the checkerboard as PackedMask ('packed') or RunLengthMask ('rle').
+
+        There are only two different rows: tile rows with even index start with a black tile (0), the others with
+        a white one (1). Both rows are encoded once and then selected per row by the parity of the tile row.
+        """
+        if encoding not in ('packed', 'rle'):
+            raise ValueError("encoding must be 'packed' or 'rle'")
+        shape = (self.resolution, self.resolution)
+        odd_rows = (np.arange(self.resolution) // self.tile_size) % 2 == 1
+
+        if encoding == 'rle':
+            # columns where the white tiles of an even row start, shifted by one tile in odd rows
+            dtype = run_dtype(shape)
+            white = np.arange(self.tile_size, self.resolution, 2 * self.tile_size, dtype=dtype)
+            starts = white[None, :] - (odd_rows[:, None] * self.tile_size).astype(dtype)
+            ends = starts + dtype(self.tile_size)
+            return RunLengthMask.from_rows(starts, ends, shape)
+
+        # the packed even row (row 0) and odd row (row tile_size), packed once from a dense row of width resolution
+        even_row = (np.arange(self.resolution) // self.tile_size) % 2 == 1
+        row_bits = np.stack([np.packbits(even_row), np.packbits(~even_row)])
+        return PackedMask(row_bits[odd_rows.astype(np.intp)], shape)
+
     def show(self):
         """
         Displays the checkerboard pattern using plt.imshow.
@@ -64,6 +222,18 @@ class Checker:
         plt.title('Checkerboard')
         plt.show()
 
+    def save(self, path: str):
+        """
+        Writes the pattern stored in 'output' to an image file (e.g. a .png) without a pyplot figure.
+
+        Unlike show() this does not block and also works in headless environments.
+        """
+
+        if self.output is None:
+            raise ValueError("Draw the pattern first using .draw()")
+
+        matplotlib.image.imsave(path, self.output, cmap='gray', vmin=0, vmax=1)
+
 ####################################################################################
 class Circle:
     def __init__(self, resolution: int, radius: int, position: tuple):
@@ -82,7 +252,7 @@ class Circle:
         self.position = position
         self.output = None
     
-    def draw(self):
+    def draw(self, encoding=None, backend='numpy'):
         """
         Generates a binary image of a circle within a square grid based on the specified resolution, center, and radius.
 
@@ -92,11 +262,29 @@ class Circle:
         The resulting binary image is stored in the `self.output` instance variable, where pixels inside the circle are set to 1 (True),
         and pixels outside the circle are set to 0 (False).
 
+        With encoding='packed' (PackedMask) or encoding='rle' (RunLengthMask) the circle is rendered directly
+        in the encoded form from the interval it covers in every row, without the dense array. The encoded
+        mask is stored in `encoded`, `output` stays untouched.
+
+        backend='blocked' evaluates the same expression block by block of rows into the output, see draw_blocked().
+        backend='sdf' thresholds the cached distance field of the center, see distance_field().
+
         Returns:
             numpy.ndarray: A copy of the generated binary circle image with shape (resolution, resolution), 
                         where 1 represents a pixel inside the circle, and 0 represents a pixel outside the circle.
         """
-        
+        if backend not in ('numpy', 'blocked', 'sdf'):
+            raise ValueError("backend must be 'numpy', 'blocked' or 'sdf'")
+        if encoding is not None:
+            self.encoded = self.draw_encoded(encoding)
+            return self.encoded.copy()
+        if backend == 'blocked':
+            self.output = self.draw_blocked()
+            return self.output.copy()
+        if backend == 'sdf':
+            self.output = (self.distance_field() <= self.radius).astype(np.uint8)
+            return self.output.copy()
+
         # create a grid of coordinates
         x = np.arange(self.resolution)
         y = np.arange(self.resolution)
@@ -122,6 +310,91 @@ class Circle:
 
         return self.output.copy()
 
+    def distance_field(self):
+        # cached float32 distance of every pixel to the center of the circle
+        return distance_field(self.resolution, *self.position)
+
+    def masks(self, radii):
+        """
+        Binary circle masks of the same center for many radii at once.
+
+        Parameters:
+            radii: list of radii
+
+        Returns:
+            numpy.ndarray: boolean stack of shape (len(radii), resolution, resolution), computed
+                           with one vectorized comparison against the cached distance field
+        """
+        radii = np.asarray(radii, dtype=np.float32)
+        return self.distance_field()[None, :, :] <= radii[:, None, None]
+
+    def annulus(self, inner: float, outer: float):
+        # boolean ring of the pixels with inner <= distance <= outer
+        dist = self.distance_field()
+        return (dist >= inner) & (dist <= outer)
+
+    def soft_mask(self, edge: float = 1.0):
+        # float32 mask falling off linearly from 1 to 0 over `edge` pixels around the radius
+        soft = (self.radius - self.distance_field()) / edge + 0.5
+        return np.clip(soft, 0, 1, out=soft)
+
+    def draw_blocked(self):
+        """
+        Fused evaluation of (xx - x_center)**2 + (yy - y_center)**2 <= radius**2.
+
+        The squared distances along x and y are vectors, only their sum for one block of rows is ever
+        materialized (in a reused buffer) and compared straight into the output.
+
+        Returns:
+            numpy.ndarray: the circle image, identical to the output of the 'numpy' backend
+        """
+        x_center, y_center = self.position
+        dx_sq = (np.arange(self.resolution) - x_center)**2
+        dy_sq = (np.arange(self.resolution) - y_center)**2
+        output = np.empty((self.resolution, self.resolution), dtype=np.uint8)
+        output_bool = output.view(bool)
+
+        blocks = row_blocks(self.resolution, self.resolution * dx_sq.itemsize)
+        buffer = np.empty((blocks[0].stop - blocks[0].start, self.resolution), dtype=np.result_type(dx_sq, dy_sq))
+        for block in blocks:
+            buf = buffer[:block.stop - block.start]
+            np.add(dx_sq[None, :], dy_sq[block, None], out=buf)
+            np.less_equal(buf, self.radius**2, out=output_bool[block])
+        return output
+
+    def row_intervals(self):
+        """
+        Computes the columns [start, end) covered by the circle in every row.
+
+        The bounds come from solving (x - x_center)**2 <= radius**2 - (y - y_center)**2 for x. Rounding
+        errors of the square root are corrected by testing the pixels next to the bounds exactly, so the
+        intervals match draw() pixel by pixel.
+        """
+        x_center, y_center = self.position
+        r_sq = self.radius**2
+        dy_sq = (np.arange(self.resolution) - y_center)**2
+        half = np.sqrt(np.maximum(r_sq - dy_sq, 0))
+
+        inside = lambda x: (x - x_center)**2 + dy_sq <= r_sq
+        start = np.ceil(x_center - half)
+        start = np.where(inside(start - 1), start - 1, start)
+        start = np.where(inside(start), start, start + 1)
+        last = np.floor(x_center + half)
+        last = np.where(inside(last + 1), last + 1, last)
+        last = np.where(inside(last), last, last - 1)
+
+        empty = dy_sq > r_sq
+        start = np.where(empty, 0, np.clip(start, 0, self.resolution)).astype(np.int64)
+        end = np.where(empty, 0, np.clip(last + 1, 0, self.resolution)).astype(np.int64)
+        return start, end
+
+    def draw_encoded(self, encoding: str):
+        # renders the circle as PackedMask ('packed') or RunLengthMask ('rle') from its row intervals
+        if encoding not in ('packed', 'rle'):
+            raise ValueError("encoding must be 'packed' or 'rle'")
+        start, end = self.row_intervals()
+        return encode_intervals(start, end, (self.resolution, self.resolution), encoding)
+
     def show(self):
         """
         Displays the checkerboard pattern using plt.imshow.
@@ -138,6 +411,18 @@ class Circle:
         plt.axis('off')
         plt.show()
 
+    def save(self, path: str):
+        """
+        Writes the pattern stored in 'output' to an image file (e.g. a .png) without a pyplot figure.
+
+        Unlike show() this does not block and also works in headless environments.
+        """
+
+        if self.output is None:
+            raise ValueError("Circle has not been drawn yet. Call draw() first.")
+
+        matplotlib.image.imsave(path, self.output, cmap='gray', vmin=0, vmax=1)
+
 ####################################################################################
 class Spectrum:
     def __init__(self, resolution: int):
@@ -156,7 +441,7 @@ class Spectrum:
         self.resolution = resolution
         self.output = None
     
-    def draw(self): 
+    def draw(self, backend='numpy'): 
         """
         Generates an RGB spectrum image based on the specified resolution.
 
@@ -174,10 +459,19 @@ class Spectrum:
         The resulting RGB image is stored in the instance variable `self.output` and 
         a copy of the image is returned.
 
+        backend='blocked' writes the channels block by block of rows without meshgrid temporaries,
+        see draw_blocked().
+
         Returns:
             numpy.ndarray: A copy of the generated RGB spectrum image with shape (resolution, resolution, 3),
                         where the third dimension represents the three color channels (R, G, B).
         """
+        if backend not in ('numpy', 'blocked'):
+            raise ValueError("backend must be 'numpy' or 'blocked'")
+        if backend == 'blocked':
+            self.output = self.draw_blocked()
+            return self.output.copy()
+
         # generate a 2D grid of pixel coordinates
         x = np.linspace(0, 1, self.resolution)  # horizontal gradient (red)
         y = np.linspace(0, 1, self.resolution)  # vertical gradient (green)
@@ -203,6 +497,24 @@ class Spectrum:
 
         return self.output.copy() 
 
+    def draw_blocked(self):
+        """
+        Fused evaluation of the spectrum: every channel of a block of rows is written straight from the
+        x or y ramp by broadcasting, so there are no (resolution x resolution) temporaries.
+
+        Returns:
+            numpy.ndarray: the spectrum image, identical to the output of the 'numpy' backend
+        """
+        x = np.linspace(0, 1, self.resolution)
+        y = np.linspace(0, 1, self.resolution)
+        x_inv = 1 - x
+        image = np.empty((self.resolution, self.resolution, 3))
+        for block in row_blocks(self.resolution, 3 * self.resolution * image.itemsize):
+            image[block, :, 0] = x
+            image[block, :, 1] = y[block, None]
+            image[block, :, 2] = x_inv
+        return image
+
     def show(self):
         """
         Displays the checkerboard pattern using plt.imshow.
@@ -219,7 +531,529 @@ class Spectrum:
         plt.axis('off')
         plt.show()
 
+    def save(self, path: str):
+        """
+        Writes the pattern stored in 'output' to an image file (e.g. a .png) without a pyplot figure.
+
+        Unlike show() this does not block and also works in headless environments.
+        """
+
+        if self.output is None:
+            raise ValueError("Spectrum has not been drawn yet. Call draw() first.")
+
+        matplotlib.image.imsave(path, self.output)
+
+####################################################################################
+# N-dimensional (e.g. volumetric) patterns. The coordinates are never materialized as full grids: every axis
+# contributes one coordinate vector, reshaped so that it broadcasts along its axis, which is accumulated in place
+# into the output. Large volumes can be rendered in slabs along the first axis with draw_into().
+
+def axis_vector(vector, axis: int, ndim: int):
+    # reshapes a coordinate vector so that it broadcasts along `axis` of an ndim-dimensional array
+    shape = [1] * ndim
+    shape[axis] = len(vector)
+    return vector.reshape(shape)
+
+
+class VolumePattern:
+    def __init__(self, shape: tuple):
+        """
+        Base class of the N-dimensional patterns.
+
+        Parameters:
+            shape: number of pixels (voxels) along every axis, does not have to be square
+
+        Subclasses implement render(out, start), which fills `out` with the slab of the pattern that
+        starts at index `start` of the first axis.
+        """
+        self.shape = tuple(int(n) for n in shape)
+        self.output = None
+
+    def empty(self, rows: int):
+        return np.zeros((rows,) + self.shape[1:], dtype=self.dtype)
+
+    def draw(self):
+        """
+        Renders the whole pattern into `output`.
+
+        Returns:
+            np.ndarray: A copy of the pattern with shape `shape` (plus a channel axis for Gradient)
+        """
+        self.output = self.empty(self.shape[0])
+        self.render(self.output, 0)
+        return self.output.copy()
+
+    def draw_into(self, out=None, chunk: int = 64):
+        """
+        Renders the pattern slab by slab (chunk indices of the first axis at a time).
+
+        Parameters:
+            out: preallocated array or np.memmap to render into, allocated if None
+            chunk: thickness of the slabs, only one slab of temporaries exists at a time
+
+        Returns:
+            np.ndarray: out
+        """
+        if out is None:
+            out = self.empty(self.shape[0])
+        for start in range(0, self.shape[0], chunk):
+            self.render(out[start:start + chunk], start)
+        return out
+
+    def rows(self, start: int, count: int):
+        # coordinates of the first axis for a slab
+        return np.arange(start, start + count)
+
+
+class CheckerND(VolumePattern):
+    dtype = np.uint8
+
+    def __init__(self, shape: tuple, tile_size):
+        """
+        N-dimensional checkerboard, e.g. 3D with cubes alternating between 0 and 1.
+
+        Parameters:
+            shape: number of voxels along every axis
+            tile_size: edge length of a tile, either one value or one per axis. Partial tiles at the
+                       far edges are allowed.
+
+        The tile at the origin is 0, like the top left tile of Checker.
+        """
+        super().__init__(shape)
+        self.tile_size = np.broadcast_to(tile_size, (len(self.shape),))
+
+    def render(self, out, start):
+        # parity of the sum of the tile indices along all axes, out may hold old values (e.g. a reused buffer)
+        ndim = len(self.shape)
+        out[...] = 0
+        for axis, (n, tile) in enumerate(zip(self.shape, self.tile_size)):
+            coords = self.rows(start, len(out)) if axis == 0 else np.arange(n)
+            out += axis_vector(((coords // tile) % 2).astype(self.dtype), axis, ndim)
+        out &= 1
+
+
+class Ellipsoid(VolumePattern):
+    dtype = bool
+
+    def __init__(self, shape: tuple, radii, center):
+        """
+        N-dimensional ellipsoid (sphere for one radius), the N-dimensional version of Circle.
+
+        Parameters:
+            shape: number of voxels along every axis
+            radii: radius along every axis, or one radius for a sphere
+            center: coordinates of the center, one per axis (same axis order as shape)
+        """
+        super().__init__(shape)
+        self.radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(self.shape),))
+        self.center = tuple(center)
+
+    def render(self, out, start):
+        # sum over the axes of ((x - center) / radius)**2, accumulated in a float32 buffer of the slab
+        ndim = len(self.shape)
+        acc = np.zeros(out.shape, dtype=np.float32)
+        for axis, (n, r, c) in enumerate(zip(self.shape, self.radii, self.center)):
+            coords = self.rows(start, len(out)) if axis == 0 else np.arange(n)
+            # a radius of 0 only keeps the center, like Circle with radius 0
+            term = ((coords - c) / r) ** 2 if r > 0 else np.where(coords == c, 0, np.inf)
+            acc += axis_vector(term.astype(np.float32), axis, ndim)
+        np.less_equal(acc, 1, out=out)
+
+
+class Gradient(VolumePattern):
+    dtype = np.float64
+
+    def __init__(self, shape: tuple):
+        """
+        N-dimensional gradient with one channel per axis, the N-dimensional version of Spectrum.
+
+        Parameters:
+            shape: number of voxels along every axis
+
+        Channel k rises linearly from 0 to 1 along axis k.
+        """
+        super().__init__(shape)
+
+    def empty(self, rows: int):
+        return np.zeros((rows,) + self.shape[1:] + (len(self.shape),), dtype=self.dtype)
+
+    def render(self, out, start):
+        ndim = len(self.shape)
+        for axis, n in enumerate(self.shape):
+            ramp = np.linspace(0, 1, n)
+            ramp = ramp[start:start + len(out)] if axis == 0 else ramp
+            out[..., axis] = axis_vector(ramp, axis, ndim)
+
+####################################################################################
+# Encoded outputs of binary patterns (Checker, Circle), see draw(encoding='packed') and draw(encoding='rle')
+
+def pack_intervals(starts, ends, width: int):
+    """
+    Bit-packs rows that contain one interval of ones each, without creating the dense rows.
+
+    Parameters:
+        starts, ends: first column and end column (exclusive) of the interval of every row, empty if ends <= starts
+        width: number of columns
+
+    Only the (at most) two edge bytes of every interval are computed, the bytes in between are set to 0xFF block
+    by block of rows, so apart from the output only O(rows) values and one block of temporaries exist.
+
+    Returns:
+        np.ndarray: uint8 array of shape (rows, ceil(width / 8)) in np.packbits layout (first column = highest bit)
+    """
+    starts, ends = np.clip(starts, 0, width), np.clip(ends, 0, width)
+    nbytes = -(-width // 8)
+    out = np.zeros((len(starts), nbytes), dtype=np.uint8)
+    rows = np.flatnonzero(ends > starts)
+    start, end = starts[rows], ends[rows]
+    first, last = start // 8, (end - 1) // 8
+
+    # edge bytes: bits from start % 8 on in the first byte, up to (end - 1) % 8 in the last byte
+    head = (0xFF >> (start - 8 * first)).astype(np.uint8)
+    tail = ((0xFF << (8 - (end - 8 * last))) & 0xFF).astype(np.uint8)
+    single = first == last
+    out[rows, first] = np.where(single, head & tail, head)
+    out[rows[~single], last[~single]] = tail[~single]
+
+    # full bytes first + 1 .. last - 1
+    lo = np.zeros(len(starts), dtype=np.int64)
+    hi = np.zeros(len(starts), dtype=np.int64)
+    lo[rows], hi[rows] = first + 1, last
+    columns = np.arange(nbytes)
+    for block in row_blocks(len(starts), nbytes):
+        full = (columns >= lo[block, None]) & (columns < hi[block, None])
+        np.copyto(out[block], 0xFF, where=full)
+    return out
+
+
+class PackedMask:
+    def __init__(self, bits: np.ndarray, shape: tuple):
+        """
+        Binary 2D mask stored with 8 pixels per byte (np.packbits layout along the rows).
+
+        Parameters:
+            bits: uint8 array of shape (height, ceil(width / 8))
+            shape: (height, width) of the mask
+
+        Logical operations (&, |, ^, ~) work on the packed bytes directly.
+        """
+        self.bits = bits
+        self.shape = tuple(shape)
+
+    @classmethod
+    def encode(cls, mask):
+        mask = np.asarray(mask).astype(bool)
+        return cls(np.packbits(mask, axis=1), mask.shape)
+
+    def decode(self):
+        # dense boolean array of the mask
+        return np.unpackbits(self.bits, axis=1, count=self.shape[1]).astype(bool)
+
+    def count(self):
+        # number of set pixels
+        return int(np.unpackbits(self.bits).sum())
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def copy(self):
+        return PackedMask(self.bits.copy(), self.shape)
+
+    def __and__(self, other):
+        return PackedMask(self.bits & other.bits, self.shape)
+
+    def __or__(self, other):
+        return PackedMask(self.bits | other.bits, self.shape)
+
+    def __xor__(self, other):
+        return PackedMask(self.bits ^ other.bits, self.shape)
+
+    def __invert__(self):
+        # the unused bits at the end of the rows have to stay 0
+        valid = pack_intervals(np.zeros(1, dtype=int), np.full(1, self.shape[1]), self.shape[1])
+        return PackedMask(~self.bits & valid, self.shape)
+
+    def __eq__(self, other):
+        return self.shape == other.shape and np.array_equal(self.bits, other.bits)
+
+
+def run_dtype(shape):
+    # integer type of the run offsets in the flattened image, int32 unless the image has 2**31 pixels or more
+    return np.int32 if shape[0] * shape[1] < 2**31 else np.int64
+
+
+class RunLengthMask:
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, shape: tuple):
+        """
+        Binary 2D mask stored as runs of ones.
+
+        Parameters:
+            starts, ends: sorted, non-overlapping runs [start, end) in the flattened (row-major) image
+            shape: (height, width) of the mask
+
+        Runs of consecutive rows may touch (or be merged across the row boundary), since the runs live in the
+        flattened image. Logical operations (&, |, ^, ~) merge the runs without decoding.
+        """
+        self.shape = tuple(shape)
+        self.starts = np.asarray(starts, dtype=run_dtype(self.shape))
+        self.ends = np.asarray(ends, dtype=run_dtype(self.shape))
+
+    @classmethod
+    def from_rows(cls, starts, ends, shape):
+        # runs given per row, as (rows, k) arrays of columns. Empty runs (end <= start) are dropped
+        dtype = run_dtype(shape)
+        starts, ends = np.array(starts, dtype=dtype), np.array(ends, dtype=dtype)
+        keep = ends > starts
+        offset = (np.arange(starts.shape[0], dtype=dtype) * dtype(shape[1])).reshape((-1,) + (1,) * (starts.ndim - 1))
+        starts += offset
+        ends += offset
+        if keep.all():
+            return cls(starts.ravel(), ends.ravel(), shape)
+        return cls(starts[keep], ends[keep], shape)
+
+    @classmethod
+    def encode(cls, mask):
+        flat = np.asarray(mask).astype(np.int8).ravel()
+        edges = np.diff(np.concatenate([[0], flat, [0]]))
+        return cls(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1), np.shape(mask))
+
+    def decode(self):
+        # dense boolean array of the mask
+        size = self.shape[0] * self.shape[1]
+        edges = np.zeros(size + 1, dtype=np.int32)
+        np.add.at(edges, self.starts, 1)
+        np.add.at(edges, self.ends, -1)
+        return np.cumsum(edges[:-1]).astype(bool).reshape(self.shape)
+
+    def count(self):
+        # number of set pixels
+        return int((self.ends - self.starts).sum())
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.ends.nbytes
+
+    def copy(self):
+        return RunLengthMask(self.starts.copy(), self.ends.copy(), self.shape)
+
+    def combine(self, other, keep):
+        """
+        Merges the runs of two masks.
+
+        All run boundaries are sorted into one event list, the cumulative sum of +1 (start) / -1 (end) events
+        gives the number of masks covering every segment between two events (0, 1 or 2). keep(coverage, own)
+        selects the segments of the result, own is the coverage by this mask alone.
+        """
+        positions = np.concatenate([self.starts, self.ends, other.starts, other.ends])
+        step = lambda runs, value: np.full(len(runs), value, dtype=np.int8)
+        steps = np.concatenate([step(self.starts, 1), step(self.ends, -1), step(other.starts, 1), step(other.ends, -1)])
+        own_steps = np.concatenate([step(self.starts, 1), step(self.ends, -1),
+                                    step(other.starts, 0), step(other.ends, 0)])
+        order = np.argsort(positions, kind='stable')
+        positions = positions[order]
+        coverage = np.cumsum(steps[order], dtype=np.int8)
+        own = np.cumsum(own_steps[order], dtype=np.int8)
+
+        # state after the last event at every distinct position
+        last = np.concatenate([positions[1:] != positions[:-1], [True]])
+        positions, inside = positions[last], keep(coverage[last], own[last]).astype(np.int8)
+        changes = np.diff(np.concatenate([[0], inside]))
+        return RunLengthMask(positions[changes == 1], positions[changes == -1], self.shape)
+
+    def __and__(self, other):
+        return self.combine(other, lambda coverage, own: coverage == 2)
+
+    def __or__(self, other):
+        return self.combine(other, lambda coverage, own: coverage > 0)
+
+    def __xor__(self, other):
+        return self.combine(other, lambda coverage, own: coverage == 1)
+
+    def __invert__(self):
+        full = RunLengthMask([0], [self.shape[0] * self.shape[1]], self.shape)
+        return full.combine(self, lambda coverage, own: coverage == 1)
+
+    def __eq__(self, other):
+        # compares the pixels, touching runs may be split differently
+        return self.shape == other.shape and (self ^ other).count() == 0
+
+
+def encode_intervals(starts, ends, shape, encoding):
+    # encoded mask of rows with one interval [start, end) of ones each
+    if encoding == 'packed':
+        return PackedMask(pack_intervals(starts, ends, shape[1]), shape)
+    return RunLengthMask.from_rows(starts, ends, shape)
+
+
+####################################################################################
+# Animated sequences: per-frame parameter trajectories rendered into a (T, H, W) array or np.memmap. After the
+# first frame every frame starts as a copy of the previous one and only the region that can change is rendered.
+
+class Sequence:
+    def __init__(self, frames: int, shape: tuple):
+        """
+        Base class of the animated patterns.
+
+        Parameters:
+            frames: number of frames T
+            shape: (height, width) of a frame
+
+        Subclasses implement draw_frame(frame, t), which renders frame t completely, and update(frame, t),
+        which turns a copy of frame t-1 into frame t. `rendered` counts the pixels rendered per frame.
+        """
+        self.frames = int(frames)
+        self.shape = tuple(int(n) for n in shape)
+        self.rendered = np.zeros(self.frames, dtype=np.int64)
+
+    def empty(self):
+        return np.zeros((self.frames,) + self.shape, dtype=self.dtype)
+
+    def render(self, out=None):
+        """
+        Renders all frames into out, frame by frame.
+
+        Parameters:
+            out: preallocated array or np.memmap of shape (T, height, width), allocated if None
+
+        Returns:
+            np.ndarray: out
+        """
+        if out is None:
+            out = self.empty()
+        if out.shape != (self.frames,) + self.shape:
+            raise ValueError("out must have the shape {}".format((self.frames,) + self.shape))
+        self.rendered[:] = 0
+        self.draw_frame(out[0], 0)
+        for t in range(1, self.frames):
+            np.copyto(out[t], out[t - 1])
+            self.update(out[t], t)
+        return out
+
+    def render_to(self, path: str):
+        # renders into a .npy file through a memory map, i.e. without holding all frames in memory
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=self.dtype, shape=(self.frames,) + self.shape)
+        self.render(out)
+        out.flush()
+        return out
+
+
+class CircleSequence(Sequence):
+    dtype = np.uint8
+
+    def __init__(self, resolution: int, radii, positions):
+        """
+        Moving and/or growing circle, every frame equals Circle(resolution, radii[t], positions[t]).draw().
+
+        Parameters:
+            resolution: number of pixels in each dimension
+            radii: radius per frame (or one radius for all frames)
+            positions: x-, y-coordinate of the center per frame, shape (T, 2) (or one position for all frames)
+
+        A frame only renders the bounding boxes of the circle in the previous and in the current frame,
+        all other pixels are outside of both circles.
+        """
+        radii, positions = np.asarray(radii), np.asarray(positions)
+        frames = max(len(radii) if radii.ndim else 1, len(positions) if positions.ndim == 2 else 1)
+        super().__init__(frames, (resolution, resolution))
+        self.resolution = resolution
+        self.radii = np.broadcast_to(radii, (frames,))
+        self.positions = np.broadcast_to(positions, (frames, 2))
+
+    def bbox(self, t: int):
+        # (top, bottom, left, right) containing all pixels of circle t (plus a margin of one pixel), None if empty
+        (x, y), r = self.positions[t], self.radii[t]
+        if r < 0:
+            return None
+        top, bottom = max(0, int(np.floor(y - r)) - 1), min(self.resolution, int(np.ceil(y + r)) + 2)
+        left, right = max(0, int(np.floor(x - r)) - 1), min(self.resolution, int(np.ceil(x + r)) + 2)
+        if top >= bottom or left >= right:
+            return None
+        return top, bottom, left, right
+
+    def draw_box(self, frame, t: int, box):
+        # evaluates the circle of frame t on the pixels of box, same expression as Circle.draw()
+        top, bottom, left, right = box
+        (x_center, y_center), radius = self.positions[t], self.radii[t]
+        dx_sq = (np.arange(left, right) - x_center)**2
+        dy_sq = (np.arange(top, bottom) - y_center)**2
+        frame[top:bottom, left:right] = (dx_sq[None, :] + dy_sq[:, None]) <= radius**2
+        self.rendered[t] += (bottom - top) * (right - left)
+
+    def draw_frame(self, frame, t: int):
+        frame[...] = 0
+        box = self.bbox(t)
+        if box is not None:
+            self.draw_box(frame, t, box)
+
+    def update(self, frame, t: int):
+        if self.radii[t] == self.radii[t - 1] and np.array_equal(self.positions[t], self.positions[t - 1]):
+            return
+        for box in (self.bbox(t - 1), self.bbox(t)):
+            if box is not None:
+                self.draw_box(frame, t, box)
+
+
+class CheckerSequence(Sequence):
+    dtype = np.float64
+
+    def __init__(self, resolution: int, tile_size: int, offsets, shape: tuple = None):
+        """
+        Sliding checkerboard, frame t equals CheckerView(tile_size, shape, offsets[t]).materialize().
+
+        Parameters:
+            resolution: number of pixels in each dimension (if shape is not given)
+            tile_size: number of pixels an individual tile has in each dimension
+            offsets: integer (row, column) offset of the board per frame, shape (T, 2)
+            shape: (height, width) of the frames, does not have to be square or divisible by 2*tile_size
+
+        A frame moves the pixels of the previous frame by the change of the offset (reduced modulo the
+        2-tile period) and only renders the rows and columns which come in at the edges.
+        """
+        offsets = np.asarray(offsets)
+        if not np.issubdtype(offsets.dtype, np.integer):
+            raise ValueError("The offsets must be integers")
+        super().__init__(len(offsets), shape if shape is not None else (resolution, resolution))
+        self.tile_size = tile_size
+        self.offsets = offsets.reshape(-1, 2)
+        self.board = CheckerView(tile_size, self.shape, dtype=self.dtype)
+
+    def shift(self, t: int):
+        # change of the offset from frame t-1 to t, the smallest equivalent one modulo the period
+        p = 2 * self.tile_size
+        delta = (self.offsets[t] - self.offsets[t - 1]) % p
+        return tuple(int(d - p) if d > p // 2 else int(d) for d in delta)
+
+    def draw_region(self, frame, t: int, rows: slice, cols: slice):
+        rows, cols = np.arange(self.shape[0])[rows], np.arange(self.shape[1])[cols]
+        if len(rows) and len(cols):
+            frame[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1] = self.board.pixels(rows + self.offsets[t][0],
+                                                                                   cols + self.offsets[t][1])
+            self.rendered[t] += len(rows) * len(cols)
+
+    def draw_frame(self, frame, t: int):
+        self.draw_region(frame, t, slice(None), slice(None))
+
+    def update(self, frame, t: int):
+        # frame[i, j] = previous[i + dy, j + dx] where both are on the canvas, the rest is rendered
+        dy, dx = self.shift(t)
+        height, width = self.shape
+        if dy == 0 and dx == 0:
+            return
+        if abs(dy) >= height or abs(dx) >= width:
+            return self.draw_frame(frame, t)
+        # the copy of the previous frame is in frame itself, slices of overlapping memory are buffered by numpy
+        frame[max(0, -dy):height - max(0, dy), max(0, -dx):width - max(0, dx)] = \
+            frame[max(0, dy):height - max(0, -dy), max(0, dx):width - max(0, -dx)]
+        edge_rows = slice(height - dy, None) if dy > 0 else slice(0, -dy)
+        edge_cols = slice(width - dx, None) if dx > 0 else slice(0, -dx)
+        self.draw_region(frame, t, edge_rows, slice(None))
+        kept_rows = slice(max(0, -dy), height - max(0, dy))
+        self.draw_region(frame, t, kept_rows, edge_cols)
+
+
 # testing
-test_object = Checker(250,25) #Spectrum(255) #Circle(1024, 200, (512, 256))  # Create a test object
-test_object.draw()  # Generate the image
-test_object.show()  # Display the generated image
\ No newline at end of file
+if __name__ == "__main__":
+    test_object = Checker(250,25) #Spectrum(255) #Circle(1024, 200, (512, 256))  # Create a test object
+    test_object.draw()  # Generate the image
+    test_object.show()  # Display the generated image